@@ -0,0 +1,21 @@
+"""
+Learn occupancy of each book status of each source from exactly crawled
+showing bookings, used when crawling with --booking_mode=estimate.
+"""
+from scrapyproject import models
+
+
+def main():
+    models.create_table(models.db_connect())
+    estimates = models.BookingEstimate.calibrate()
+    for estimate in sorted(estimates,
+                           key=lambda x: (x.source, x.book_status)):
+        print("{0} {1}: {2:.2%} from {3} bookings".format(
+            estimate.source, estimate.book_status, estimate.occupancy,
+            estimate.sample_count))
+    print("{0} estimates calibrated".format(len(estimates)))
+    models.Session.remove()
+
+
+if __name__ == '__main__':
+    main()
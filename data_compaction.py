@@ -0,0 +1,55 @@
+"""
+Compact booking data of old showings, booking rows of each showing are
+collapsed into a summary row and deleted.
+
+Totals in data_handler.py are kept as summaries keep booking row count
+and book seat count sum of collapsed rows.
+"""
+import argparse
+import arrow
+from sqlalchemy import and_
+from scrapyproject import models
+
+
+def get_showing_ids(cutoff, batch_size):
+    """
+    ids of showings started before cutoff and still have booking rows
+    """
+    query = models.Session.query(models.ShowingBooking.showing_id).filter(
+        and_(models.ShowingBooking.showing_id == models.Showing.id,
+             models.Showing.start_time < cutoff)
+        ).distinct().limit(batch_size)
+    return [showing_id for showing_id, in query]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Cinema booking data compaction program.')
+    parser.add_argument('--days', type=int, required=False, default=90,
+                        help='compact showings started before these days')
+    parser.add_argument('--batch_size', type=int, required=False,
+                        default=1000,
+                        help='showings compacted in one transaction')
+    args = parser.parse_args()
+    models.create_table(models.db_connect())
+    cutoff = arrow.utcnow().shift(days=-args.days)
+    showing_count = 0
+    row_count = 0
+    while True:
+        showing_ids = get_showing_ids(cutoff, args.batch_size)
+        if not showing_ids:
+            break
+        try:
+            row_count += models.ShowingBookingSummary.compact(showing_ids)
+            models.Session.commit()
+        except Exception:
+            models.Session.rollback()
+            raise
+        showing_count += len(showing_ids)
+        print("{0} showings compacted, {1} rows deleted".format(
+            showing_count, row_count))
+    models.Session.remove()
+
+
+if __name__ == '__main__':
+    main()
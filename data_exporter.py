@@ -0,0 +1,227 @@
+"""
+Export crawled data into parquet files for analysis, so that analysts do
+not need to query production database.
+
+showing and showing_booking are partitioned by show date and source,
+cinema and movie are written as single files. Strings are dictionary
+encoded and times are written as native UTC timestamps.
+In incremental mode only showings and bookings with ids larger than last
+export are appended, showings updated later are not exported again.
+ids are taken from sequences before rows are committed, so ids skipped
+below last exported id are remembered and read again in next export, a
+row is appended once when its transaction commits.
+This program requires pyarrow.
+"""
+import argparse
+import json
+import os
+import shutil
+import pyarrow
+import pyarrow.parquet
+import sqlalchemy
+from scrapyproject import models
+
+
+string_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+time_type = pyarrow.timestamp('us', tz='UTC')
+
+showing_columns = [
+    ('id', pyarrow.int64()),
+    ('title', string_type),
+    ('title_en', string_type),
+    ('real_title', string_type),
+    ('start_time', time_type),
+    ('end_time', time_type),
+    ('cinema_name', string_type),
+    ('cinema_site', string_type),
+    ('screen', string_type),
+    ('seat_type', string_type),
+    ('total_seat_count', pyarrow.int64()),
+]
+showing_booking_columns = [
+    ('id', pyarrow.int64()),
+    ('showing_id', pyarrow.int64()),
+    ('book_status', string_type),
+    ('book_seat_count', pyarrow.int64()),
+    ('minutes_before', pyarrow.int64()),
+    ('record_time', time_type),
+    ('estimated', pyarrow.bool_()),
+]
+cinema_columns = [
+    ('id', pyarrow.int64()),
+    ('names', pyarrow.list_(pyarrow.string())),
+    ('county', string_type),
+    ('company', string_type),
+    ('site', pyarrow.string()),
+    ('screens', pyarrow.string()),
+    ('screen_count', pyarrow.int64()),
+    ('total_seats', pyarrow.int64()),
+    ('source', string_type),
+]
+movie_columns = [
+    ('id', pyarrow.int64()),
+    ('title', pyarrow.string()),
+    ('current_cinema_count', pyarrow.int64()),
+]
+# columns files are partitioned by
+partition_columns = [('show_date', pyarrow.string()),
+                     ('source', pyarrow.string())]
+
+state_file_name = 'export_state.json'
+# skipped ids this far below last exported id are taken as rolled back
+gap_window = 10000
+
+
+def to_value(value):
+    """
+    convert database value into value pyarrow accepts
+    """
+    if hasattr(value, 'naive'):
+        # ArrowType values, stored as naive utc time
+        return value.to('UTC').naive
+    elif isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def to_table(rows, columns):
+    arrays = []
+    for idx, (_, column_type) in enumerate(columns):
+        values = [to_value(row[idx]) for row in rows]
+        if column_type == string_type:
+            array = pyarrow.array(values, type=pyarrow.string())
+            array = array.dictionary_encode()
+        else:
+            array = pyarrow.array(values, type=column_type)
+        arrays.append(array)
+    return pyarrow.Table.from_arrays(arrays, [x for x, _ in columns])
+
+
+def write_partitioned(rows, columns, path):
+    table = to_table(rows, columns + partition_columns)
+    pyarrow.parquet.write_to_dataset(
+        table, path, partition_cols=[x for x, _ in partition_columns])
+
+
+def id_filter(column, min_id, gap_ids):
+    """
+    rows with id larger than min_id or in skipped ids of last export
+    """
+    condition = column > min_id
+    if gap_ids:
+        condition = sqlalchemy.or_(condition, column.in_(gap_ids))
+    return condition
+
+
+def export_showings(session, path, min_id, gap_ids, batch_size):
+    """
+    export showings with id larger than min_id or in gap_ids,
+    return (max exported id, skipped ids)
+    """
+    query = session.query(
+        *([getattr(models.Showing, x) for x, _ in showing_columns] +
+          [models.Showing.start_time, models.Showing.source])
+        ).filter(
+            id_filter(models.Showing.id, min_id, gap_ids)
+        ).order_by(models.Showing.id)
+    return write_query(query, showing_columns, path, min_id, gap_ids,
+                       batch_size)
+
+
+def export_showing_bookings(session, path, min_id, gap_ids, batch_size):
+    """
+    export bookings with id larger than min_id or in gap_ids, partitioned
+    by their showings, return (max exported id, skipped ids)
+    """
+    query = session.query(
+        *([getattr(models.ShowingBooking, x)
+           for x, _ in showing_booking_columns] +
+          [models.Showing.start_time, models.Showing.source])
+        ).filter(
+            models.ShowingBooking.showing_id == models.Showing.id,
+            id_filter(models.ShowingBooking.id, min_id, gap_ids)
+        ).order_by(models.ShowingBooking.id)
+    return write_query(query, showing_booking_columns, path, min_id,
+                       gap_ids, batch_size)
+
+
+def write_query(query, columns, path, max_id, gap_ids, batch_size):
+    """
+    stream query rows with id first and start time and source last into
+    partitioned files, batch by batch.
+    ids skipped below max exported id may belong to transactions not
+    committed yet, they are returned to be read again in next export.
+    """
+    rows = []
+    gaps = set(gap_ids)
+    for row in query.yield_per(batch_size):
+        (start_time, source) = row[-2:]
+        show_date = models.BookingRollup.get_show_date(start_time)
+        rows.append(list(row[:-2]) + [show_date.isoformat(), source])
+        if row[0] > max_id:
+            gaps.update(range(max(max_id, row[0] - gap_window) + 1,
+                              row[0]))
+            max_id = row[0]
+        else:
+            gaps.discard(row[0])
+        if len(rows) >= batch_size:
+            write_partitioned(rows, columns, path)
+            rows = []
+    if rows:
+        write_partitioned(rows, columns, path)
+    return (max_id, sorted(x for x in gaps if x > max_id - gap_window))
+
+
+def export_table(session, model, columns, path):
+    query = session.query(*[getattr(model, x) for x, _ in columns])
+    table = to_table(query.all(), columns)
+    pyarrow.parquet.write_table(table, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Cinema data parquet export program.')
+    parser.add_argument('--dir', type=str, required=False,
+                        default="export", help='export directory')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only append data written after last export')
+    parser.add_argument('--batch_size', type=int, required=False,
+                        default=100000, help='rows written in one file')
+    args = parser.parse_args()
+    state_path = os.path.join(args.dir, state_file_name)
+    state = {'showing_id': 0, 'showing_booking_id': 0}
+    if args.incremental and os.path.exists(state_path):
+        with open(state_path) as state_file:
+            state.update(json.load(state_file))
+    elif not args.incremental:
+        # remove partitioned files of last export
+        for name in ('showing', 'showing_booking'):
+            shutil.rmtree(os.path.join(args.dir, name), ignore_errors=True)
+    os.makedirs(args.dir, exist_ok=True)
+
+    # read all tables in one snapshot so that they are consistent
+    session = models.Session()
+    session.connection(
+        execution_options={'isolation_level': 'REPEATABLE READ'})
+    (state['showing_booking_id'],
+     state['showing_booking_gap_ids']) = export_showing_bookings(
+        session, os.path.join(args.dir, 'showing_booking'),
+        state['showing_booking_id'],
+        state.get('showing_booking_gap_ids', []), args.batch_size)
+    (state['showing_id'], state['showing_gap_ids']) = export_showings(
+        session, os.path.join(args.dir, 'showing'), state['showing_id'],
+        state.get('showing_gap_ids', []), args.batch_size)
+    # cinema and movie tables are small, always export all
+    export_table(session, models.Cinema, cinema_columns,
+                 os.path.join(args.dir, 'cinema.parquet'))
+    export_table(session, models.Movie, movie_columns,
+                 os.path.join(args.dir, 'movie.parquet'))
+    session.close()
+    with open(state_path, 'w') as state_file:
+        json.dump(state, state_file)
+    print("exported showing id <= {0}, showing booking id <= {1}".format(
+        state['showing_id'], state['showing_booking_id']))
+
+
+if __name__ == '__main__':
+    main()
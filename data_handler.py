@@ -1,9 +1,170 @@
 import argparse
-import re
-import unicodedata
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import arrow
 from scrapyproject import models
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import func
+
+
+# change when result format or queries change, so that old cache is unused
+query_version = 2
+
+
+class ResultCache(object):
+    """
+    result lines cached in files named by hash of query arguments and data
+    watermark, so that cache is missed after new data is crawled.
+    least recently used files are removed when total size exceeds max_size,
+    other files in path are left alone
+    """
+    suffix = '.cache'
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(*args):
+        key = repr((query_version,) + args)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        return iterator of cached lines, or None if not cached
+        """
+        file_path = os.path.join(self.path, key + self.suffix)
+        if not os.path.exists(file_path):
+            return None
+        # mark as recently used
+        os.utime(file_path)
+        return self.read(file_path)
+
+    @staticmethod
+    def read(file_path):
+        with open(file_path) as cache_file:
+            for line in cache_file:
+                yield line
+
+    def put(self, key, lines):
+        """
+        yield lines and write them into cache, cache file is only added
+        after all lines are written
+        """
+        os.makedirs(self.path, exist_ok=True)
+        file_path = os.path.join(self.path, key + self.suffix)
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            for line in lines:
+                cache_file.write(line)
+                yield line
+        os.replace(temp_path, file_path)
+        self.evict()
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.path):
+            # temp files of other writers end with .tmp, not suffix
+            file_path = os.path.join(self.path, name)
+            if not name.endswith(self.suffix) or not os.path.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            files.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            total_size -= size
+
+
+def parse_date(date):
+    """
+    parse YYYYMMDD date in japan timezone
+    """
+    if date is None:
+        return None
+    return arrow.get(date, 'YYYYMMDD').replace(tzinfo='UTC+9')
+
+
+def query_results(args):
+    """
+    yield result lines, rows are streamed from server side cursor and
+    titles are merged in database
+    """
+    cinema = args.cinema if args.cinema is not None else 'total'
+    if args.per_showing:
+        query = models.ShowingBookingSummary.get_showing_totals(
+            args.cinema, args.merge, parse_date(args.start_date),
+            parse_date(args.end_date))
+    else:
+        query = models.BookingRollup.get_title_totals(
+            args.cinema, args.merge)
+    for row in query.yield_per(args.batch_size):
+        if args.per_showing:
+            (title, cinema_name, screen, start_time, book_seat_count,
+             total_seat_count, count, estimated_count) = row
+            name = "{0} {1} {2} {3}".format(
+                title, cinema_name, screen,
+                start_time.to('Asia/Tokyo').format('YYYY-MM-DD HH:mm'))
+        else:
+            (title, book_seat_count, total_seat_count, count,
+             estimated_count) = row
+            name = "{0} {1}".format(title, cinema)
+        book_seat_count = 0 if book_seat_count is None else book_seat_count
+        total_seat_count = 0 if total_seat_count is None else total_seat_count
+        percent = "{:.2%}".format(book_seat_count/(
+            1 if not total_seat_count else total_seat_count))
+        yield "{0}: {1}/{2} {3} {4} times {5} estimated\n".format(
+            name, book_seat_count, total_seat_count, percent, count,
+            estimated_count or 0)
+
+
+def report_results(args):
+    """
+    yield lines of booking status per title and cinema, source and show
+    date and in total, all computed in one query
+    """
+    query = models.ShowingBookingSummary.get_dimension_totals(
+        args.cinema, args.merge, parse_date(args.start_date),
+        parse_date(args.end_date))
+    columns = ['dimension', 'title', 'cinema', 'source', 'show_date',
+               'book_seat_count', 'total_seat_count', 'percent', 'count',
+               'estimated_count']
+    if args.format == 'csv':
+        yield to_csv_line(columns)
+    else:
+        yield "[\n"
+    for idx, row in enumerate(query.yield_per(args.batch_size)):
+        (dimension, title, cinema_name, source, show_date, book_seat_count,
+         total_seat_count, count, estimated_count) = row
+        book_seat_count = 0 if book_seat_count is None else book_seat_count
+        total_seat_count = 0 if total_seat_count is None else total_seat_count
+        percent = book_seat_count/(
+            1 if not total_seat_count else total_seat_count)
+        values = [dimension, title, cinema_name, source,
+                  show_date.isoformat() if show_date else None,
+                  int(book_seat_count), int(total_seat_count),
+                  round(percent, 4), int(count), int(estimated_count or 0)]
+        if args.format == 'csv':
+            yield to_csv_line(values)
+        else:
+            yield "{0}{1}".format(",\n" if idx else "", json.dumps(
+                dict(zip(columns, values)), ensure_ascii=False))
+    if args.format != 'csv':
+        yield "\n]\n"
+
+
+def to_csv_line(values):
+    line = io.StringIO()
+    csv.writer(line, lineterminator='\n').writerow(values)
+    return line.getvalue()
 
 
 def main():
@@ -15,55 +176,54 @@ def main():
                         help='target cinema')
     parser.add_argument('--merge', type=bool, required=False, default=False,
                         help='merge different version of same movie')
+    parser.add_argument('--per_showing', action='store_true',
+                        help='extract booking status of every showing')
+    parser.add_argument('--report', action='store_true',
+                        help='extract booking status of every title per '
+                        'cinema, source and show date into one file')
+    parser.add_argument('--format', type=str, required=False,
+                        default='csv', choices=['csv', 'json'],
+                        help='file format of --report')
+    parser.add_argument('--start_date', type=str, required=False,
+                        help='with --per_showing or --report, only use '
+                        'booking data recorded from this date, '
+                        'format YYYYMMDD')
+    parser.add_argument('--end_date', type=str, required=False,
+                        help='with --per_showing or --report, only use '
+                        'booking data recorded before this date, '
+                        'format YYYYMMDD')
+    parser.add_argument('--batch_size', type=int, required=False,
+                        default=1000, help='rows fetched from database at once')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='do not use cached result')
+    parser.add_argument('--cache_dir', type=str, required=False,
+                        default="cache", help='result cache directory')
+    parser.add_argument('--cache_size', type=int, required=False,
+                        default=100, help='max result cache size in MB')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='recompute booking rollup from raw data')
     args = parser.parse_args()
-    # firgure out movie booking status
-    engine = models.db_connect()
-    session = sessionmaker(bind=engine)()
-    book_count_label = func.sum(
-        models.ShowingBooking.book_seat_count).label("book_count")
-    query = session.query(
-        models.Showing.title,
-        book_count_label,
-        func.sum(models.Showing.total_seat_count),
-        func.count(models.Showing.id)
-        ).filter(
-            models.ShowingBooking.showing_id == models.Showing.id
-        ).group_by(models.Showing.title).order_by(book_count_label.desc())
-    if args.cinema is not None:
-        query = query.filter(models.Showing.cinema_name == args.cinema)
-    result = {}
-    for (title, book_seat_count, total_seat_count, count) in query.all():
-        title = unicodedata.normalize('NFKC', title)
-        cinema = args.cinema if args.cinema is not None else 'total'
-        book_seat_count = 0 if book_seat_count is None else book_seat_count
-        total_seat_count = 0 if total_seat_count is None else total_seat_count
-        if args.merge:
-            # remove movie version in title
-            title = re.sub(r"^(.+)\((.+)\)$", r"\1", title)
-            title = title.strip()
-        if title not in result:
-            result[title] = {}
-            result[title]['cinema'] = cinema
-            result[title]['book_seat_count'] = book_seat_count
-            result[title]['total_seat_count'] = total_seat_count
-            result[title]['count'] = count
-        else:
-            result[title]['book_seat_count'] += book_seat_count
-            result[title]['total_seat_count'] += total_seat_count
-            result[title]['count'] += count
+    models.create_table(models.db_connect())
+    if args.rebuild:
+        models.BookingRollup.rebuild()
+    session = models.Session()
+    cache = ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    key = cache.get_key(args.cinema, args.merge, args.per_showing,
+                        args.report, args.format, args.start_date,
+                        args.end_date, models.BookingRollup.get_watermark())
+    if args.no_cache or args.rebuild:
+        lines = None
+    else:
+        lines = cache.get(key)
+    # result lines on stdout stay machine readable
+    print("cache {0}".format("miss" if lines is None else "hit"),
+          file=sys.stderr)
+    if lines is None:
+        results = report_results if args.report else query_results
+        lines = cache.put(key, results(args))
     with open(args.file, 'w') as result_file:
-        for title in result:
-            cinema = result[title]['cinema']
-            book_seat_count = result[title]['book_seat_count']
-            total_seat_count = result[title]['total_seat_count']
-            count = result[title]['count']
-            percent = "{:.2%}".format(book_seat_count/(
-                1 if not total_seat_count else total_seat_count))
-            result_str = "{0} {1}: {2}/{3} {4} {5} times".format(
-                title, cinema, book_seat_count, total_seat_count,
-                percent, count)
-            print(result_str)
-            result_str += "\n"
+        for result_str in lines:
+            print(result_str.rstrip("\n"))
             result_file.write(result_str)
     session.close()
 
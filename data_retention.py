@@ -0,0 +1,64 @@
+"""
+Drop old monthly partitions of showing booking data, optionally archive
+them into gzip compressed csv files first.
+
+Whole partitions are dropped instead of deleting rows. Rows of a
+partition are merged into showing booking summaries in the same
+transaction, so totals in data_handler.py and rollup recomputed by
+--rebuild are not changed. Rows of the same showings in kept partitions
+stay raw.
+"""
+import argparse
+import gzip
+import os
+import arrow
+from scrapyproject import models
+
+
+def archive_partition(engine, name, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    file_path = os.path.join(archive_dir, name + '.csv.gz')
+    connection = engine.raw_connection()
+    try:
+        with gzip.open(file_path, 'wt', encoding='utf-8') as archive_file:
+            cursor = connection.cursor()
+            cursor.copy_expert(
+                'COPY {0} TO STDOUT WITH CSV HEADER'.format(name),
+                archive_file)
+    finally:
+        connection.close()
+    return file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Cinema booking data retention program.')
+    parser.add_argument('--keep_months', type=int, required=False,
+                        default=12, help='count of recent months to keep, '
+                        'including current month')
+    parser.add_argument('--archive_dir', type=str, required=False,
+                        help='archive partitions here before dropped')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='only print partitions to drop')
+    args = parser.parse_args()
+    engine = models.db_connect()
+    models.create_table(engine)
+    table = models.ShowingBooking.__table__
+    cutoff = arrow.utcnow().floor('month').shift(
+        months=-(args.keep_months - 1))
+    for month, name in models.get_partitions(engine, table):
+        if month >= cutoff:
+            continue
+        if args.dry_run:
+            print("{0} will be dropped".format(name))
+            continue
+        if args.archive_dir is not None:
+            file_path = archive_partition(engine, name, args.archive_dir)
+            print("{0} archived to {1}".format(name, file_path))
+        models.drop_partition(engine, table, name, [
+            models.ShowingBookingSummary.get_partition_summary_sql(name)])
+        print("{0} summarized and dropped".format(name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Occupancy curve analysis of showing booking snapshots.
+
+Every showing booking row is a snapshot of booked seats some minutes before
+showing starts. Snapshots of each showing are interpolated onto a common
+grid of minutes before start, then curves are averaged per title, source
+or cinema. All snapshots are read in one query and computed with numpy
+arrays, no loop over rows in python. This program requires numpy.
+"""
+import argparse
+import csv
+import numpy
+from sqlalchemy import select, and_
+from scrapyproject import models
+
+
+def load_snapshots(cinema=None, merge=False):
+    """
+    read snapshots of showings with seat count in one query, return dict
+    of arrays ordered by showing and minutes before
+    """
+    showing = models.Showing.__table__
+    showing_booking = models.ShowingBooking.__table__
+    title = models.Showing.get_report_title(showing.c.title, merge)
+    conditions = [showing_booking.c.showing_id == showing.c.id,
+                  showing.c.total_seat_count > 0]
+    if cinema is not None:
+        conditions.append(showing.c.cinema_name == cinema)
+    query = select([
+        showing.c.id, title, showing.c.source, showing.c.cinema_name,
+        showing.c.total_seat_count, showing_booking.c.minutes_before,
+        showing_booking.c.book_seat_count
+    ]).where(and_(*conditions)).order_by(
+        showing.c.id, showing_booking.c.minutes_before)
+    rows = models.Session.execute(query).fetchall()
+    models.Session.remove()
+    names = ['showing_id', 'title', 'source', 'cinema', 'total_seat_count',
+             'minutes_before', 'book_seat_count']
+    columns = list(zip(*rows)) if rows else [[] for _ in names]
+    snapshots = dict((name, numpy.array(column, dtype=object))
+                     for name, column in zip(names, columns))
+    for name in ('showing_id', 'total_seat_count', 'minutes_before',
+                 'book_seat_count'):
+        snapshots[name] = snapshots[name].astype(numpy.float64)
+    return snapshots
+
+
+def compute_curves(snapshots, grid):
+    """
+    interpolate occupancy ratio of each showing onto grid of minutes
+    before start, points out of snapshot range of a showing are nan.
+    return index of first snapshot of each showing and curve matrix of
+    shape (showing count, grid size)
+    """
+    showing_ids = snapshots['showing_id']
+    minutes_before = snapshots['minutes_before']
+    ratios = snapshots['book_seat_count'] / snapshots['total_seat_count']
+    # rows are ordered by showing, so each showing is a segment
+    starts = numpy.flatnonzero(numpy.r_[True, showing_ids[1:] !=
+                                        showing_ids[:-1]])
+    ends = numpy.r_[starts[1:], len(showing_ids)] - 1
+    showing_numbers = numpy.cumsum(numpy.r_[False, showing_ids[1:] !=
+                                            showing_ids[:-1]])
+    # shift each showing to its own x range so that one interp call
+    # covers all showings
+    span = max(minutes_before.max(), grid.max()) - min(
+        minutes_before.min(), grid.min()) + 1
+    x = showing_numbers * span + minutes_before
+    grid_x = (numpy.arange(len(starts))[:, None] * span + grid[None, :])
+    curves = numpy.interp(grid_x.ravel(), x, ratios).reshape(grid_x.shape)
+    # do not extrapolate before first or after last snapshot
+    outside = ((grid[None, :] < minutes_before[starts][:, None]) |
+               (grid[None, :] > minutes_before[ends][:, None]))
+    curves[outside] = numpy.nan
+    return starts, curves
+
+
+def aggregate_curves(labels, curves):
+    """
+    average curves of showings with same label ignoring nan, return
+    labels, showing counts and mean curves
+    """
+    group_labels, groups = numpy.unique(labels, return_inverse=True)
+    grid_size = curves.shape[1]
+    index = (groups[:, None] * grid_size +
+             numpy.arange(grid_size)[None, :]).ravel()
+    length = len(group_labels) * grid_size
+    known = ~numpy.isnan(curves)
+    sums = numpy.bincount(index, weights=numpy.where(known, curves, 0)
+                          .ravel(), minlength=length)
+    counts = numpy.bincount(index, weights=known.ravel(), minlength=length)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / counts).reshape(len(group_labels), grid_size)
+    showing_counts = numpy.bincount(groups, minlength=len(group_labels))
+    return group_labels, showing_counts, means
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Showing occupancy curve analysis program.')
+    parser.add_argument('--file', type=str, required=False,
+                        default="occupancy.csv", help='result file name')
+    parser.add_argument('--cinema', type=str, required=False,
+                        help='target cinema')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge different version of same movie')
+    parser.add_argument('--group_by', type=str, required=False,
+                        default='title', choices=['title', 'source', 'cinema'],
+                        help='dimension curves are averaged by')
+    parser.add_argument('--max_minutes', type=int, required=False,
+                        default=1440, help='max minutes before start')
+    parser.add_argument('--step', type=int, required=False, default=30,
+                        help='minutes between grid points')
+    args = parser.parse_args()
+    snapshots = load_snapshots(args.cinema, args.merge)
+    if not len(snapshots['showing_id']):
+        print("no snapshot found")
+        return
+    grid = numpy.arange(args.max_minutes, -1, -args.step, dtype=numpy.float64)
+    starts, curves = compute_curves(snapshots, grid)
+    labels = snapshots[args.group_by][starts].astype(str)
+    group_labels, showing_counts, means = aggregate_curves(labels, curves)
+    # most shown first
+    order = numpy.argsort(-showing_counts, kind='mergesort')
+    with open(args.file, 'w', newline='') as result_file:
+        writer = csv.writer(result_file)
+        writer.writerow([args.group_by, 'showing_count'] +
+                        [int(x) for x in grid])
+        for idx in order:
+            writer.writerow(
+                [group_labels[idx], showing_counts[idx]] +
+                ['' if numpy.isnan(x) else "{:.4f}".format(x)
+                 for x in means[idx]])
+    print("{0} snapshots of {1} showings, {2} {3} curves written".format(
+        len(snapshots['showing_id']), len(starts), len(group_labels),
+        args.group_by))
+
+
+if __name__ == '__main__':
+    main()
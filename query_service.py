@@ -0,0 +1,191 @@
+"""
+Read only HTTP query service of booking data for dashboards.
+
+Aggregates are computed from booking rollup with a pooled database
+connection kept in process, results are cached in a bounded LRU cache
+which is cleared when new showing booking data is written.
+
+endpoints, all return json and accept "merge=1" to merge title versions:
+- /titles?cinema=...: booking status per title
+- /cinemas?title=...: booking status per cinema
+- /occupancy?title=...&cinema=...: booking status per show date
+"""
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from scrapyproject import models
+
+
+def to_result(key, book_seat_count, total_seat_count, count,
+              estimated_count):
+    book_seat_count = int(book_seat_count or 0)
+    total_seat_count = int(total_seat_count or 0)
+    return {
+        'key': key,
+        'book_seat_count': book_seat_count,
+        'total_seat_count': total_seat_count,
+        'percent': round(book_seat_count/(
+            1 if not total_seat_count else total_seat_count), 4),
+        'count': int(count or 0),
+        'estimated_count': int(estimated_count or 0),
+    }
+
+
+def query_titles(params, merge):
+    query = models.BookingRollup.get_title_totals(
+        params.get('cinema'), merge)
+    return [to_result(*row) for row in query]
+
+
+def query_cinemas(params, merge):
+    query = models.BookingRollup.get_cinema_totals(
+        params.get('title'), merge)
+    return [to_result(*row) for row in query]
+
+
+def query_occupancy(params, merge):
+    query = models.BookingRollup.get_date_totals(
+        params.get('title'), params.get('cinema'), merge)
+    return [to_result(row[0].isoformat(), *row[1:]) for row in query]
+
+
+endpoints = {
+    '/titles': query_titles,
+    '/cinemas': query_cinemas,
+    '/occupancy': query_occupancy,
+}
+
+
+class ResultCache(object):
+    """
+    LRU cache of query results, cleared when watermark of booking data
+    changes. watermark is checked at most once every check_interval
+    seconds. results are kept with watermark they are computed under, so
+    a result computed before the watermark changed is never returned.
+    """
+    def __init__(self, max_count, check_interval):
+        self.max_count = max_count
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.watermark = None
+        self.checked_time = 0
+
+    def check_watermark(self):
+        """
+        return current watermark, read from database when it is due
+        """
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked_time < self.check_interval:
+                return self.watermark
+            self.checked_time = now
+        watermark = models.BookingRollup.get_watermark()
+        with self.lock:
+            if watermark != self.watermark:
+                self.watermark = watermark
+                self.results.clear()
+            return self.watermark
+
+    def get(self, key, watermark):
+        with self.lock:
+            if key not in self.results:
+                return None
+            (result_watermark, result) = self.results[key]
+            if result_watermark != watermark:
+                return None
+            self.results.move_to_end(key)
+            return result
+
+    def put(self, key, watermark, result):
+        """
+        add result computed under watermark, dropped if watermark changed
+        while it was computed
+        """
+        with self.lock:
+            if watermark != self.watermark:
+                return
+            self.results[key] = (watermark, result)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_count:
+                self.results.popitem(last=False)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    cache = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query_func = endpoints.get(url.path)
+        if query_func is None:
+            self.send_json(404, {'error': 'unknown endpoint'})
+            return
+        params = dict((x, y[0]) for x, y in parse_qs(url.query).items())
+        merge = params.pop('merge', '0') not in ('0', '')
+        key = (url.path, merge, tuple(sorted(params.items())))
+        try:
+            watermark = self.cache.check_watermark()
+            result = self.cache.get(key, watermark)
+            if result is None:
+                result = json.dumps(query_func(params, merge),
+                                    ensure_ascii=False)
+                self.cache.put(key, watermark, result)
+        except Exception:
+            models.Session.rollback()
+            self.log_error('failed to query %s', self.path)
+            self.send_json(500, {'error': 'query failed'})
+            return
+        finally:
+            # every request runs in a new thread, return its connection
+            # to pool
+            models.Session.remove()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(result.encode('utf-8'))
+
+    def send_json(self, code, data):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode('utf-8'))
+
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Cinema booking data query service.')
+    parser.add_argument('--host', type=str, required=False,
+                        default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, required=False, default=8080,
+                        help='listen port')
+    parser.add_argument('--cache_count', type=int, required=False,
+                        default=1000, help='max count of cached results')
+    parser.add_argument('--check_interval', type=float, required=False,
+                        default=5, help='seconds between checks of new data')
+    parser.add_argument('--pool_size', type=int, required=False, default=4,
+                        help='database connection pool size')
+    args = parser.parse_args()
+    # all transactions are read only
+    models.configure_engine(pool_size=args.pool_size, connect_args={
+        'options': '-c default_transaction_read_only=on'})
+    models.db_connect()
+    QueryHandler.cache = ResultCache(args.cache_count, args.check_interval)
+    server = QueryServer((args.host, args.port), QueryHandler)
+    print("query service started on {0}:{1}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -39,7 +39,8 @@ def showing_booking_crawl_job():
     try:
         call(["scrapy", "crawl", "--all_showing", "--keep_old_data",
               "--crawl_booking_data", "--crawl_all_cinemas",
-              "--crawl_all_movies", "-s", "JOBDIR=job/showing_booking"])
+              "--crawl_all_movies", "-s", "JOBDIR=job/showing_booking",
+              "-s", "DATABASE_COPY_SHOWING_BOOKING=1"])
     finally:
         shutil.rmtree('job/showing_booking', ignore_errors=True)
 
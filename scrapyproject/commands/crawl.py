@@ -2,6 +2,29 @@ import copy
 from optparse import OptionGroup
 import arrow
 from scrapy.commands.crawl import Command
+from scrapy.exceptions import UsageError
+
+
+# spiders run with --all_showing option
+all_showing_spiders = ['aeon', 'toho_v2', 'united', 'movix', 'kinezo',
+                       'site109', 'korona', 'cinemasunshine', 'forum']
+
+
+def get_date_list(date_range):
+    """
+    days from START to END of "START:END" range, both included
+    """
+    try:
+        start, end = date_range.split(':')
+        start = arrow.get(start, 'YYYYMMDD')
+        end = arrow.get(end, 'YYYYMMDD')
+    except (ValueError, arrow.parser.ParserError):
+        raise UsageError("Invalid --date_range value, use START:END like "
+                         "20170301:20170307")
+    if start > end:
+        raise UsageError("--date_range START is later than END")
+    return [x.format('YYYYMMDD') for x in arrow.Arrow.range(
+        'day', start, end)]
 
 
 class CrawlCommand(Command):
@@ -32,6 +55,11 @@ class CrawlCommand(Command):
         group.add_option("--crawl_booking_data", action="store_true",
                          default=False,
                          help="crawl booking data for each crawled showing")
+        group.add_option("--booking_mode", default="exact",
+                         choices=["exact", "estimate"],
+                         help="exact: crawl seat page of each showing, "
+                         "estimate: estimate book seat count from book "
+                         "status, implies --crawl_booking_data")
         group.add_option("--movie_list",  action="append",
                          default=[], metavar="moviename",
                          help="crawl movie list, default is 君の名は。")
@@ -41,10 +69,23 @@ class CrawlCommand(Command):
         tomorrow = arrow.now('UTC+9').shift(days=+1)
         group.add_option("--date", default=tomorrow.format('YYYYMMDD'),
                          help="crawl date, default is tomorrow")
+        group.add_option("--date_range", default=None,
+                         metavar="START:END",
+                         help="crawl all dates from START to END in one "
+                         "traversal of cinemas, overrides --date")
         parser.add_option_group(group)
 
     def process_options(self, args, opts):
         Command.process_options(self, args, opts)
+        if opts.date_range:
+            opts.date_list = get_date_list(opts.date_range)
+            opts.date = opts.date_list[0]
+        else:
+            opts.date_list = [opts.date]
+        # crawlers in process share database connection pool
+        if opts.all_showing:
+            self.settings.set('DATABASE_CRAWLER_COUNT',
+                              len(all_showing_spiders), priority='cmdline')
 
     def run(self, args, opts):
         # pass custom option to spiders
@@ -54,10 +95,13 @@ class CrawlCommand(Command):
         opts.spargs['keep_old_data'] = opts.keep_old_data
         opts.spargs['crawl_all_cinemas'] = opts.crawl_all_cinemas
         opts.spargs['crawl_all_movies'] = opts.crawl_all_movies
-        opts.spargs['crawl_booking_data'] = opts.crawl_booking_data
+        opts.spargs['crawl_booking_data'] = (
+            opts.crawl_booking_data or opts.booking_mode == 'estimate')
+        opts.spargs['booking_mode'] = opts.booking_mode
         opts.spargs['movie_list'] = opts.movie_list
         opts.spargs['cinema_list'] = opts.cinema_list
         opts.spargs['date'] = opts.date
+        opts.spargs['date_list'] = opts.date_list
         if opts.all_showing:
             self.run_multiple_spiders(args, opts)
         else:
@@ -65,15 +109,8 @@ class CrawlCommand(Command):
 
     def run_multiple_spiders(self, args, opts):
         # option passed to spider need deep copy
-        self.crawler_process.crawl('aeon', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('toho_v2', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('united', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('movix', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('kinezo', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('site109', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('korona', **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('cinemasunshine',
-                                   **copy.deepcopy(opts.spargs))
-        self.crawler_process.crawl('forum', **copy.deepcopy(opts.spargs))
+        for spider_name in all_showing_spiders:
+            self.crawler_process.crawl(spider_name,
+                                       **copy.deepcopy(opts.spargs))
         self.crawler_process.start()
         return
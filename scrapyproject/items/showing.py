@@ -4,7 +4,7 @@ import unicodedata
 import scrapy
 from scrapy.loader import ItemLoader
 from scrapy.loader.processors import Identity, TakeFirst
-from scrapyproject.models import Movie, Cinema
+from scrapyproject.models import movie_title_resolver, cinema_catalog
 from scrapyproject.items import (standardize_cinema_name,
                                  standardize_screen_name)
 from scrapyproject.utils import standardize_site_url
@@ -55,7 +55,7 @@ class ShowingLoader(ItemLoader):
             title_en = unicodedata.normalize('NFKC', title_en)
         self.add_value('title', title)
         self.add_value('title_en', title_en)
-        self.add_value('real_title', Movie.get_by_title(title))
+        self.add_value('real_title', movie_title_resolver.get_by_title(title))
 
     def get_title_list(self):
         title = self.get_output_value('title')
@@ -67,6 +67,6 @@ class ShowingLoader(ItemLoader):
         cinema_name = self.get_output_value('cinema_name')
         cinema_site = self.get_output_value('cinema_site')
         screen = self.get_output_value('screen')
-        self.add_value('total_seat_count', Cinema.get_screen_seat_count(
-                cinema_name=cinema_name, cinema_site=cinema_site,
-                screen=screen))
+        seat_count = cinema_catalog.get_screen_seat_count(
+            cinema_name=cinema_name, cinema_site=cinema_site, screen=screen)
+        self.add_value('total_seat_count', seat_count)
@@ -4,6 +4,7 @@ import scrapy
 from scrapy.loader import ItemLoader
 from scrapy.loader.processors import Identity, TakeFirst
 from scrapyproject.items.showing import Showing
+from scrapyproject.models import booking_estimator
 
 
 class ShowingBooking(scrapy.Item):
@@ -12,6 +13,8 @@ class ShowingBooking(scrapy.Item):
     book_seat_count = scrapy.Field()
     minutes_before = scrapy.Field()
     record_time = scrapy.Field()
+    # True if book seat count is estimated from book status
+    estimated = scrapy.Field()
 
 
 class ShowingBookingLoader(ItemLoader):
@@ -31,6 +34,18 @@ class ShowingBookingLoader(ItemLoader):
         value = util.standardize_book_status(book_status)
         self.add_value('book_status', value)
 
+    def add_estimated_book_seat_count(self):
+        """
+        estimate book seat count from book status and calibrated occupancy
+        of showing's source instead of crawling seat page
+        """
+        showing = self.get_output_value('showing')
+        book_seat_count = booking_estimator.estimate(
+            showing.get('source'), self.get_output_value('book_status'),
+            showing.get('total_seat_count'))
+        self.add_value('book_seat_count', book_seat_count)
+        self.add_value('estimated', True)
+
 
 def init_show_booking_loader(response, item=None):
     """
@@ -0,0 +1,143 @@
+"""
+Adaptive concurrency middleware, control concurrency of each spider and
+each cookiejar
+"""
+from collections import deque
+from twisted.internet import defer, reactor
+from scrapy.exceptions import NotConfigured
+
+
+class AdaptiveConcurrencyMiddleware(object):
+    """
+    limit requests downloading at the same time for a spider, as every
+    showing spider crawls one chain, this is concurrency of the chain.
+
+    if spider has attribute "serialize_cookiejar", requests of the same
+    cookiejar are downloaded one by one as they share a session, requests
+    of different cookiejars are downloaded in parallel.
+
+    concurrency starts at ADAPTIVE_CONCURRENCY_START, grows by one after
+    as many fast responses as current concurrency and is halved on 5xx
+    responses, download errors and session expiry. session expiry is
+    judged by spider's "is_session_expired(request, response)" if defined.
+    latency is scrapy's download_latency, time spent waiting for a slot
+    here is not counted.
+    """
+    meta_key = 'adaptive_concurrency_slot'
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.min_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MIN', 1)
+        self.max_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MAX', 8)
+        self.concurrency = settings.getint('ADAPTIVE_CONCURRENCY_START', 1)
+        self.target_latency = settings.getfloat(
+            'ADAPTIVE_CONCURRENCY_TARGET_LATENCY', 2.0)
+        self.latency = None
+        self.success_count = 0
+        self.active_count = 0
+        self.busy_cookiejars = set()
+        # (deferred, request, spider) waiting to be downloaded
+        self.waiting = deque()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    @staticmethod
+    def get_cookiejar(request, spider):
+        if not getattr(spider, 'serialize_cookiejar', False):
+            return None
+        return ('cookiejar', request.meta.get('cookiejar'))
+
+    def can_start(self, request, spider):
+        cookiejar = self.get_cookiejar(request, spider)
+        return (self.active_count < self.concurrency and
+                (cookiejar is None or
+                 cookiejar not in self.busy_cookiejars))
+
+    def start(self, request, spider):
+        self.active_count += 1
+        cookiejar = self.get_cookiejar(request, spider)
+        if cookiejar is not None:
+            self.busy_cookiejars.add(cookiejar)
+        request.meta[self.meta_key] = True
+
+    def finish(self, request, spider):
+        """
+        release slot of request, return False if request did not take a
+        slot
+        """
+        if not request.meta.pop(self.meta_key, False):
+            return False
+        self.active_count -= 1
+        cookiejar = self.get_cookiejar(request, spider)
+        if cookiejar is not None:
+            self.busy_cookiejars.discard(cookiejar)
+        self.start_waiting()
+        return True
+
+    def start_waiting(self):
+        """
+        start waiting requests that can be downloaded now, in order
+        """
+        for entry in list(self.waiting):
+            (d, request, spider) = entry
+            if self.active_count >= self.concurrency:
+                break
+            if self.can_start(request, spider):
+                self.waiting.remove(entry)
+                self.start(request, spider)
+                # do not continue download chain inside this call
+                reactor.callLater(0, d.callback, None)
+
+    def process_request(self, request, spider):
+        if self.can_start(request, spider):
+            self.start(request, spider)
+            return None
+        d = defer.Deferred()
+        self.waiting.append((d, request, spider))
+        return d
+
+    def process_response(self, request, response, spider):
+        if not self.finish(request, spider):
+            return response
+        is_session_expired = getattr(spider, 'is_session_expired', None)
+        if response.status >= 500:
+            self.decrease('server_error', spider)
+        elif is_session_expired and is_session_expired(request, response):
+            self.decrease('session_expired', spider)
+        elif response.meta.get('download_latency') is not None:
+            self.update_latency(response.meta['download_latency'], spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if self.finish(request, spider):
+            self.decrease('download_error', spider)
+
+    def update_latency(self, latency, spider):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        if self.latency > 2 * self.target_latency:
+            self.set_concurrency(self.concurrency - 1, spider)
+        elif self.latency <= self.target_latency:
+            self.success_count += 1
+            if self.success_count >= self.concurrency:
+                self.set_concurrency(self.concurrency + 1, spider)
+
+    def decrease(self, reason, spider):
+        self.stats.inc_value(
+            'adaptive_concurrency/' + reason, spider=spider)
+        self.set_concurrency(self.concurrency // 2, spider)
+
+    def set_concurrency(self, concurrency, spider):
+        self.concurrency = max(self.min_concurrency,
+                               min(self.max_concurrency, concurrency))
+        self.success_count = 0
+        self.stats.max_value('adaptive_concurrency/max_concurrency',
+                             self.concurrency, spider=spider)
+        self.start_waiting()
@@ -44,6 +44,10 @@ class CustomCookiesMiddleware(object):
             self._jars[request.meta['cookiejar']] = \
                 deepcopy(self._jars[copied_cookiejar_key])
 
+        # Drop cookies of expired session if request.meta['clear_cookiejar']
+        if request.meta.get('clear_cookiejar'):
+            self._jars.pop(request.meta['cookiejar'], None)
+
         self._cookies_middleware.process_request(request, spider)
 
     def process_response(self, request, response, spider):
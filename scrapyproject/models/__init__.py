@@ -3,8 +3,19 @@ Persist level for JapanCinemaStatusSpider
 """
 
 from scrapyproject.models.models import (create_table, drop_table_if_exist,
+                                         create_partitions, get_partitions,
+                                         drop_partition, configure_engine,
+                                         get_missing_unique_indexes,
                                          db_connect, Session)
-from scrapyproject.models.cinema import Cinema
-from scrapyproject.models.showing import Showing
+from scrapyproject.models.cinema import (Cinema, CinemaCatalog,
+                                         CinemaReconciler, cinema_catalog)
+from scrapyproject.models.showing import Showing, ShowingIndex
 from scrapyproject.models.showing_booking import ShowingBooking
-from scrapyproject.models.movie import Movie
+from scrapyproject.models.showing_booking_summary import \
+    ShowingBookingSummary
+from scrapyproject.models.booking_rollup import BookingRollup
+from scrapyproject.models.booking_estimate import (BookingEstimate,
+                                                   BookingEstimator,
+                                                   booking_estimator)
+from scrapyproject.models.movie import (Movie, MovieTitleResolver,
+                                        movie_title_resolver)
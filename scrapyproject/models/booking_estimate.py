@@ -0,0 +1,95 @@
+from sqlalchemy import Column, Integer, String, Float, Index
+from sqlalchemy.sql import func
+from scrapyproject.models import Session
+from scrapyproject.models.models import DeclarativeBase
+from scrapyproject.models.showing import Showing
+from scrapyproject.models.showing_booking import ShowingBooking
+
+
+# used before calibrated, roughly matching meaning of each book status
+default_occupancy = {
+    'PlentyLeft': 0.1,
+    'HalfFull': 0.5,
+    'FewSeatsLeft': 0.85,
+    'SoldOut': 1.0,
+    'NotSold': 0.0,
+}
+
+# book status with too few exact samples keeps default occupancy
+min_sample_count = 30
+
+
+class BookingEstimate(DeclarativeBase):
+    """
+    average occupancy of showings of each source (chain) in each book
+    status, learned from exactly crawled showing bookings
+    """
+    __tablename__ = "booking_estimate"
+    __table_args__ = (
+        Index('ix_booking_estimate_source_book_status',
+              'source', 'book_status', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    source = Column('source', String, nullable=False)
+    book_status = Column('book_status', String, nullable=False)
+    occupancy = Column('occupancy', Float, nullable=False)
+    sample_count = Column('sample_count', Integer, nullable=False)
+
+    @staticmethod
+    def calibrate():
+        """
+        recompute occupancy of all sources and book status from exactly
+        crawled showing bookings in one transaction, return new estimates
+        """
+        occupancy = func.avg(
+            func.least(ShowingBooking.book_seat_count * 1.0 /
+                       Showing.total_seat_count, 1.0))
+        query = Session.query(
+            Showing.source, ShowingBooking.book_status, occupancy,
+            func.count(ShowingBooking.id)
+            ).filter(
+                ShowingBooking.showing_id == Showing.id,
+                ShowingBooking.estimated.is_(False),
+                Showing.total_seat_count > 0
+            ).group_by(Showing.source, ShowingBooking.book_status)
+        estimates = [
+            BookingEstimate(source=source, book_status=book_status,
+                            occupancy=float(value), sample_count=count)
+            for source, book_status, value, count in query
+            if count >= min_sample_count]
+        Session.query(BookingEstimate).delete()
+        Session.add_all(estimates)
+        Session.commit()
+        return estimates
+
+
+class BookingEstimator(object):
+    """
+    In memory calibrated occupancy, loaded from database before spiders
+    estimate book seat count, so that they do not query database.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self.occupancy = {}
+
+    def load(self):
+        for estimate in Session.query(BookingEstimate):
+            self.occupancy[(estimate.source, estimate.book_status)] = \
+                estimate.occupancy
+        self.loaded = True
+
+    def estimate(self, source, book_status, total_seat_count):
+        """
+        estimate book seat count of a showing from its book status
+        """
+        occupancy = self.occupancy.get(
+            (source, book_status), default_occupancy.get(book_status, 0))
+        return int(round((total_seat_count or 0) * occupancy))
+
+
+# shared in process
+booking_estimator = BookingEstimator()
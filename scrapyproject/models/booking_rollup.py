@@ -0,0 +1,204 @@
+from collections import OrderedDict
+from sqlalchemy import Column, Integer, BigInteger, String, Date, Index
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from scrapyproject.models import Session
+from scrapyproject.models.models import DeclarativeBase
+from scrapyproject.models.showing import Showing
+from scrapyproject.models.showing_booking import ShowingBooking
+
+
+# showings are in japan, so show date is start date in UTC+9
+show_date_offset_hours = 9
+
+# recompute all rows from showing booking rows and summaries of compacted
+# showings
+rebuild_sql = """
+INSERT INTO booking_rollup (title, cinema_name, show_date, book_seat_count,
+                            total_seat_count, showing_booking_count,
+                            estimated_booking_count)
+SELECT sh.title, sh.cinema_name,
+    CAST(sh.start_time + interval '{offset} hours' AS date),
+    SUM(sb.book_seat_count), SUM(sh.total_seat_count), COUNT(*),
+    COUNT(*) FILTER (WHERE sb.estimated)
+FROM showing_booking sb JOIN showing sh ON sb.showing_id = sh.id
+GROUP BY 1, 2, 3;
+INSERT INTO booking_rollup (title, cinema_name, show_date, book_seat_count,
+                            total_seat_count, showing_booking_count,
+                            estimated_booking_count)
+SELECT sh.title, sh.cinema_name,
+    CAST(sh.start_time + interval '{offset} hours' AS date),
+    SUM(ss.book_seat_count_sum),
+    SUM(sh.total_seat_count * ss.showing_booking_count),
+    SUM(ss.showing_booking_count), SUM(ss.estimated_booking_count)
+FROM showing_booking_summary ss JOIN showing sh ON ss.showing_id = sh.id
+GROUP BY 1, 2, 3
+ON CONFLICT (title, cinema_name, show_date) DO UPDATE SET
+    book_seat_count =
+        booking_rollup.book_seat_count + excluded.book_seat_count,
+    total_seat_count =
+        booking_rollup.total_seat_count + excluded.total_seat_count,
+    showing_booking_count =
+        booking_rollup.showing_booking_count + excluded.showing_booking_count,
+    estimated_booking_count =
+        booking_rollup.estimated_booking_count +
+        excluded.estimated_booking_count
+""".format(offset=show_date_offset_hours)
+
+
+class BookingRollup(DeclarativeBase):
+    """
+    booking sums of showing_booking rows grouped by showing title, cinema
+    and show date, same as summing joined showing and showing_booking rows.
+
+    rows are updated when showing booking items are written, showing data
+    at that time is used, so it may differ from raw rows if showing is
+    changed later, use rebuild to recompute.
+    """
+    __tablename__ = "booking_rollup"
+    __table_args__ = (
+        Index('ix_booking_rollup_key',
+              'title', 'cinema_name', 'show_date', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    title = Column('title', String, nullable=False)
+    cinema_name = Column('cinema_name', String, nullable=False)
+    show_date = Column('show_date', Date, nullable=False)
+    book_seat_count = Column('book_seat_count', BigInteger, default=0,
+                             nullable=False)
+    total_seat_count = Column('total_seat_count', BigInteger, default=0,
+                              nullable=False)
+    showing_booking_count = Column('showing_booking_count', Integer,
+                                   default=0, nullable=False)
+    # rows of showing_booking_count whose book seat count is estimated,
+    # see ShowingBooking.estimated
+    estimated_booking_count = Column('estimated_booking_count', Integer,
+                                     default=0, nullable=False,
+                                     server_default='0')
+
+    @staticmethod
+    def get_show_date(start_time):
+        return start_time.to('UTC').shift(
+            hours=show_date_offset_hours).date()
+
+    @staticmethod
+    def add_items(items):
+        """
+        add showing booking items to rollup rows in one statement.
+        This runs in global session's transaction and caller should commit,
+        so that rollup is committed together with bookings.
+        """
+        values = OrderedDict()
+        for item in items:
+            showing = item['showing']
+            key = (showing['title'], showing['cinema_name'],
+                   BookingRollup.get_show_date(showing['start_time']))
+            value = values.setdefault(key, {
+                'title': key[0],
+                'cinema_name': key[1],
+                'show_date': key[2],
+                'book_seat_count': 0,
+                'total_seat_count': 0,
+                'showing_booking_count': 0,
+                'estimated_booking_count': 0
+            })
+            value['book_seat_count'] += item.get('book_seat_count') or 0
+            value['total_seat_count'] += showing.get('total_seat_count') or 0
+            value['showing_booking_count'] += 1
+            if item.get('estimated'):
+                value['estimated_booking_count'] += 1
+        if not values:
+            return
+        table = BookingRollup.__table__
+        statement = insert(table).values(list(values.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=['title', 'cinema_name', 'show_date'],
+            set_=dict((x, table.c[x] + statement.excluded[x]) for x in (
+                'book_seat_count', 'total_seat_count',
+                'showing_booking_count', 'estimated_booking_count')))
+        Session.execute(statement)
+
+    @staticmethod
+    def get_watermark():
+        """
+        showing booking watermark with latest rollup id, which is changed
+        by rebuild as rows are inserted again
+        """
+        (rollup_id,) = Session.query(func.max(BookingRollup.id)).one()
+        return ShowingBooking.get_watermark() + (rollup_id,)
+
+    @staticmethod
+    def rebuild():
+        """
+        recompute all rollup rows from raw rows and summaries in one
+        transaction, rows of dropped partitions are counted by summaries
+        data_retention.py makes before dropping
+        """
+        Session.query(BookingRollup).delete()
+        Session.execute(rebuild_sql)
+        Session.commit()
+
+    @staticmethod
+    def get_title_totals(cinema_name=None, merge=False):
+        """
+        query booking sums per normalized title, ordered by book count
+        descending, see Showing.get_report_title. last column of every
+        totals query is count of estimated bookings
+        """
+        title = Showing.get_report_title(
+            BookingRollup.title, merge).label("report_title")
+        book_count_label = func.sum(
+            BookingRollup.book_seat_count).label("book_count")
+        query = Session.query(
+            title,
+            book_count_label,
+            func.sum(BookingRollup.total_seat_count),
+            func.sum(BookingRollup.showing_booking_count),
+            func.sum(BookingRollup.estimated_booking_count)
+            ).group_by(title).order_by(book_count_label.desc())
+        if cinema_name is not None:
+            query = query.filter(BookingRollup.cinema_name == cinema_name)
+        return query
+
+    @staticmethod
+    def get_cinema_totals(title=None, merge=False):
+        """
+        query booking sums per cinema, ordered by book count descending,
+        limited to a normalized title if given
+        """
+        book_count_label = func.sum(
+            BookingRollup.book_seat_count).label("book_count")
+        query = Session.query(
+            BookingRollup.cinema_name,
+            book_count_label,
+            func.sum(BookingRollup.total_seat_count),
+            func.sum(BookingRollup.showing_booking_count),
+            func.sum(BookingRollup.estimated_booking_count)
+            ).group_by(BookingRollup.cinema_name).order_by(
+                book_count_label.desc())
+        if title is not None:
+            query = query.filter(Showing.get_report_title(
+                BookingRollup.title, merge) == title)
+        return query
+
+    @staticmethod
+    def get_date_totals(title=None, cinema_name=None, merge=False):
+        """
+        query booking sums per show date, ordered by show date, limited to
+        a normalized title and a cinema if given
+        """
+        query = Session.query(
+            BookingRollup.show_date,
+            func.sum(BookingRollup.book_seat_count),
+            func.sum(BookingRollup.total_seat_count),
+            func.sum(BookingRollup.showing_booking_count),
+            func.sum(BookingRollup.estimated_booking_count)
+            ).group_by(BookingRollup.show_date).order_by(
+                BookingRollup.show_date)
+        if title is not None:
+            query = query.filter(Showing.get_report_title(
+                BookingRollup.title, merge) == title)
+        if cinema_name is not None:
+            query = query.filter(BookingRollup.cinema_name == cinema_name)
+        return query
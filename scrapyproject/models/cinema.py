@@ -1,5 +1,6 @@
+from collections import OrderedDict
 from enum import Enum
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy import and_, or_, cast
 from scrapyproject.models import Session
@@ -9,6 +10,10 @@ from scrapyproject.utils import ScreenUtils
 
 class Cinema(DeclarativeBase):
     __tablename__ = "cinema"
+    __table_args__ = (
+        # used to find cinema by any of its names
+        Index('ix_cinema_names', 'names', postgresql_using='gin'),
+    )
 
     id = Column(Integer, primary_key=True)
     # name may differ depends on crawled site, so we collect all names
@@ -95,5 +100,163 @@ class Cinema(DeclarativeBase):
                     self.screen_count += 1
                     self.total_seats += curr_seat_count
         else:
-            new_cinema.id = self.id
-            self = new_cinema
+            # keep names crawled from other sites as they are used to find
+            # this cinema
+            names = new_cinema.names + [x for x in self.names if
+                                        x not in new_cinema.names]
+            for column in self.__table__.columns:
+                if column.name != 'id':
+                    setattr(self, column.name,
+                            getattr(new_cinema, column.name))
+            self.names = names
+
+
+class CinemaReconciler(object):
+    """
+    Keep all cinemas in memory, so that crawled cinemas can be merged into
+    them without querying database and changed cinemas can be written
+    together.
+
+    Cinemas are indexed by county with site and by county with each name,
+    same as the rule of Cinema.get_cinema_if_exist. Cinemas are kept out of
+    session and written with bulk statements.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self.cinemas_by_site = {}
+        self.cinemas_by_name = {}
+        # new or changed cinemas keyed by object id, in change order
+        self.changed_cinemas = OrderedDict()
+
+    def load(self):
+        query = Session.query(Cinema).order_by(Cinema.id)
+        for cinema in query.all():
+            Session.expunge(cinema)
+            self.index(cinema)
+        self.loaded = True
+
+    def index(self, cinema):
+        if cinema.site:
+            self.cinemas_by_site.setdefault(
+                (cinema.county, cinema.site), cinema)
+        for name in cinema.names:
+            self.cinemas_by_name.setdefault((cinema.county, name), cinema)
+
+    def get_cinema_if_exist(self, item):
+        """
+        same as Cinema.get_cinema_if_exist but search in memory
+        """
+        cinema = None
+        if item.site is not None:
+            cinema = self.cinemas_by_site.get((item.county, item.site))
+        if cinema is None and item.names is not None:
+            for name in item.names:
+                cinema = self.cinemas_by_name.get((item.county, name))
+                if cinema is not None:
+                    break
+        return cinema
+
+    def update(self, cinema):
+        """
+        add new cinema or mark merged cinema as changed
+        """
+        self.index(cinema)
+        self.changed_cinemas[id(cinema)] = cinema
+
+    def get_changed_cinemas(self):
+        return list(self.changed_cinemas.values())
+
+    @staticmethod
+    def write(cinemas):
+        """
+        write cinemas with bulk statements in global session and caller
+        should commit, return mappings of new cinemas for mark_written
+        """
+        columns = [x.name for x in Cinema.__table__.columns]
+        exist_mappings = [dict((x, getattr(cinema, x)) for x in columns)
+                          for cinema in cinemas if cinema.id is not None]
+        new_mappings = [dict((x, getattr(cinema, x)) for x in columns
+                             if x != 'id')
+                        for cinema in cinemas if cinema.id is None]
+        Session.bulk_update_mappings(Cinema, exist_mappings)
+        Session.bulk_insert_mappings(Cinema, new_mappings,
+                                     return_defaults=True)
+        return new_mappings
+
+    def mark_written(self, cinemas, new_mappings):
+        """
+        set ids of new cinemas after committed
+        """
+        new_cinemas = [x for x in cinemas if x.id is None]
+        for cinema, mapping in zip(new_cinemas, new_mappings):
+            cinema.id = mapping['id']
+        for cinema in cinemas:
+            self.changed_cinemas.pop(id(cinema), None)
+
+
+class CinemaCatalog(object):
+    """
+    In memory catalog of all cinemas, loaded from database when first used.
+
+    Cinemas are indexed by stored site url and by all their names,
+    and seat count of every queried screen is memorized, so that crawled
+    showings do not need to query database for their seat counts.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self.cinemas_by_site = {}
+        self.cinemas_by_name = {}
+        self.seat_counts = {}
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def load(self):
+        query = Session.query(Cinema).order_by(Cinema.id)
+        for cinema in query.all():
+            # stored site is matched as it is, like Cinema.site == site
+            if cinema.site:
+                self.cinemas_by_site.setdefault(cinema.site, cinema)
+            for name in cinema.names or []:
+                self.cinemas_by_name.setdefault(name, cinema)
+        self.loaded = True
+
+    def get_cinema(self, cinema_name, cinema_site):
+        """
+        find cinema by site first and then by name
+        """
+        if not self.loaded:
+            self.load()
+        cinema = None
+        if cinema_site is not None:
+            cinema = self.cinemas_by_site.get(cinema_site)
+        if cinema is None and cinema_name is not None:
+            cinema = self.cinemas_by_name.get(cinema_name)
+        return cinema
+
+    def get_screen_seat_count(self, cinema_name, cinema_site, screen):
+        """
+        same as Cinema.get_screen_seat_count but use catalog data
+        """
+        key = (cinema_name, cinema_site, screen)
+        if key in self.seat_counts:
+            self.hit_count += 1
+            return self.seat_counts[key]
+        self.miss_count += 1
+        cinema = self.get_cinema(cinema_name, cinema_site)
+        if not cinema:
+            seat_count = 0
+        else:
+            seat_count = ScreenUtils.get_seat_count(
+                cinema.screens, cinema_name, screen)
+        self.seat_counts[key] = seat_count
+        return seat_count
+
+
+# catalog shared in process, showings of all spiders use same cinema data
+cinema_catalog = CinemaCatalog()
@@ -1,17 +1,183 @@
-from sqlalchemy import create_engine
+import logging
+import threading
+import arrow
+from sqlalchemy import create_engine, event, inspect, select
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine.url import URL
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateColumn, CreateTable
 from sqlalchemy_utils import database_exists, create_database
 from scrapyproject import settings
 
 
+logger = logging.getLogger(__name__)
+
 DeclarativeBase = declarative_base()
 
 
-def create_table(engine):
+@compiles(CreateTable, 'postgresql')
+def create_partitioned_table(create, compiler, **kwargs):
+    """
+    create table with "PARTITION BY RANGE" if column name is set in
+    table's info as "partition_by", partitions are created by
+    create_partitions
+    """
+    sql = compiler.visit_create_table(create, **kwargs)
+    partition_by = create.element.info.get('partition_by')
+    if partition_by:
+        sql = sql.rstrip() + ' PARTITION BY RANGE ({0})\n\n'.format(
+            partition_by)
+    return sql
+
+
+def create_table(engine, partition_months_ahead=None):
+    """
+    create missing tables, columns, indexes and partitions of current
+    month and partition_months_ahead months after, which defaults to
+    DATABASE_PARTITION_MONTHS_AHEAD setting
+    """
+    if partition_months_ahead is None:
+        partition_months_ahead = settings.DATABASE_PARTITION_MONTHS_AHEAD
     DeclarativeBase.metadata.create_all(engine)
+    create_missing_column(engine)
+    create_missing_index(engine)
+    # make sure data crawled now has its partition
+    now = arrow.utcnow()
+    for table in DeclarativeBase.metadata.sorted_tables:
+        if table.info.get('partition_by'):
+            create_partitions(engine, table, now, now.shift(
+                months=+partition_months_ahead))
+
+
+def is_partitioned(engine, table):
+    """
+    tables created before partitioning is declared are not partitioned
+    """
+    result = engine.execute(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c "
+        "ON p.partrelid = c.oid WHERE c.relname = %s", table.name)
+    return result.first() is not None
+
+
+def get_partition_name(table, month):
+    return '{0}_{1}'.format(table.name, month.format('YYYYMM'))
+
+
+def create_partitions(engine, table, start_time, end_time):
+    """
+    create monthly partitions of table from month of start_time to month
+    of end_time, and default partition for data out of them.
+    times are utc as ArrowType stores them.
+    """
+    if not is_partitioned(engine, table):
+        logger.warning('table %s is not partitioned', table.name)
+        return
+    engine.execute(
+        'CREATE TABLE IF NOT EXISTS {0}_default PARTITION OF {0} '
+        'DEFAULT'.format(table.name))
+    start_month = start_time.to('utc').floor('month')
+    end_month = end_time.to('utc').floor('month')
+    for month, _ in arrow.Arrow.span_range('month', start_month, end_month):
+        name = get_partition_name(table, month)
+        try:
+            engine.execute(
+                "CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} FOR VALUES "
+                "FROM ('{2}') TO ('{3}')".format(
+                    name, table.name, month.naive.isoformat(),
+                    month.shift(months=+1).naive.isoformat()))
+        except SQLAlchemyError:
+            # fails if default partition already has data of this month,
+            # data is still written into default partition
+            logger.exception('failed to create partition %s', name)
+
+
+def get_partitions(engine, table):
+    """
+    return monthly partitions of table as list of (month, name), ordered
+    by month, default partition is not included
+    """
+    result = engine.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON i.inhrelid = c.oid "
+        "JOIN pg_class p ON i.inhparent = p.oid "
+        "WHERE p.relname = %s", table.name)
+    partitions = []
+    for (name,) in result:
+        suffix = name[len(table.name) + 1:]
+        if suffix.isdigit():
+            partitions.append((arrow.get(suffix, 'YYYYMM'), name))
+    return sorted(partitions)
+
+
+def drop_partition(engine, table, name, statements=()):
+    """
+    detach and drop a partition, much cheaper than deleting its rows.
+    statements, like summarizing its rows, run first in same transaction
+    """
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(statement)
+        connection.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(
+            table.name, name))
+        connection.execute('DROP TABLE {0}'.format(name))
+
+
+def create_missing_column(engine):
+    """
+    create_all only creates columns together with new tables, so add
+    columns declared later to exist tables here. such columns should be
+    nullable or have server default.
+    """
+    inspector = inspect(engine)
+    for table in DeclarativeBase.metadata.sorted_tables:
+        exist_column_names = set(
+            column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in exist_column_names:
+                continue
+            column_sql = CreateColumn(column).compile(dialect=engine.dialect)
+            engine.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+                table.name, column_sql))
+
+
+def create_missing_index(engine):
+    """
+    create_all only creates indexes together with new tables, so create
+    indexes declared later for exist tables here.
+    index replaced by new one is dropped after new one is created, its
+    name is set in new index's info as "replaces".
+    """
+    inspector = inspect(engine)
+    for table in DeclarativeBase.metadata.sorted_tables:
+        exist_index_names = set(
+            index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in exist_index_names:
+                continue
+            try:
+                index.create(engine)
+            except SQLAlchemyError:
+                # unique index can not be created with duplicate data,
+                # keep data and let user fix it
+                logger.exception('failed to create index %s', index.name)
+                continue
+            replaced_index_name = index.info.get('replaces')
+            if replaced_index_name in exist_index_names:
+                engine.execute('DROP INDEX ' + replaced_index_name)
+
+
+def get_missing_unique_indexes(engine, table):
+    """
+    names of unique indexes declared on table but not in database, like
+    those failed to be created by create_missing_index
+    """
+    exist_index_names = set(
+        index['name'] for index in inspect(engine).get_indexes(table.name))
+    return [index.name for index in table.indexes
+            if index.unique and index.name not in exist_index_names]
 
 
 def drop_table_if_exist(engine, TableClass):
@@ -19,16 +185,65 @@ def drop_table_if_exist(engine, TableClass):
         TableClass.__table__.drop(engine)
 
 
+# engine shared in process, created when first used
+engine_lock = threading.Lock()
+engine_options = {}
+shared_engine = None
+
+
+def configure_engine(**kwargs):
+    """
+    set options like pool size for shared engine, only work before engine
+    is created
+    """
+    engine_options.update(kwargs)
+
+
+def ping_connection(connection, branch):
+    """
+    check connection before used and reconnect if it is invalidated, as
+    connections in pool may be closed by database server.
+    """
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except DBAPIError as err:
+        # connection is invalidated and whole pool is refreshed here,
+        # so try again with new connection
+        if err.connection_invalidated:
+            connection.scalar(select([1]))
+        else:
+            raise
+    finally:
+        connection.should_close_with_result = should_close_with_result
+
+
 def db_connect():
     """
     Connect to database described in settings
     if database is not yet exist,will create first
+    engine is created once and shared in process
     """
-    engine = create_engine(URL(**settings.DATABASE))
-    if not database_exists(engine.url):
-        create_database(engine.url)
-    return engine
+    global shared_engine
+    with engine_lock:
+        if shared_engine is None:
+            engine = create_engine(URL(**settings.DATABASE),
+                                   **engine_options)
+            event.listen(engine, 'engine_connect', ping_connection)
+            if not database_exists(engine.url):
+                create_database(engine.url)
+            shared_engine = engine
+    return shared_engine
+
+
+def create_session():
+    return session_factory(bind=db_connect())
 
 
 # global session for project
-Session = scoped_session(sessionmaker(bind=db_connect()))
+# objects are kept usable after commit as pipeline caches them in memory
+session_factory = sessionmaker(expire_on_commit=False)
+Session = scoped_session(create_session)
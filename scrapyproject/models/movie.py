@@ -1,11 +1,16 @@
-from fuzzywuzzy import process
-from sqlalchemy import Column, Integer, String
+from collections import defaultdict
+from fuzzywuzzy import process, utils
+from sqlalchemy import Column, Integer, String, Index
+from sqlalchemy.dialects.postgresql import insert
 from scrapyproject.models import Session
 from scrapyproject.models.models import DeclarativeBase
 
 
 class Movie(DeclarativeBase):
     __tablename__ = "movie"
+    __table_args__ = (
+        Index('ix_movie_title', 'title', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column('title', String, nullable=False)
@@ -23,6 +28,24 @@ class Movie(DeclarativeBase):
         result = query.first()
         return result
 
+    @staticmethod
+    def upsert_items(items):
+        """
+        Insert movie items in one statement, exist movies are kept as they
+        are, same as pipeline does without upsert.
+        """
+        # a row can not be updated twice in one statement, use last one
+        values = dict((item['title'], {
+            'title': item['title'],
+            'current_cinema_count': item.get('current_cinema_count')
+        }) for item in items)
+        if not values:
+            return
+        statement = insert(Movie.__table__).values(list(values.values()))
+        statement = statement.on_conflict_do_nothing(
+            index_elements=['title'])
+        Session.execute(statement)
+
     @staticmethod
     def get_by_title(title):
         """
@@ -40,3 +63,91 @@ class Movie(DeclarativeBase):
             return result_title
         else:
             return None
+
+
+class MovieTitleResolver(object):
+    """
+    Resolve crawled title like Movie.get_by_title, with movie titles loaded
+    once and indexed by character, and resolved titles memorized.
+
+    A movie title sharing no character but space with crawled title can not
+    score over 50, so only titles sharing characters with crawled title
+    are scored, which gives the same result as scoring all titles.
+    This does not hold for titles mostly made of spaces, so they are
+    always scored.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self.titles = []
+        self.title_ids_by_char = defaultdict(set)
+        self.spaced_title_ids = set()
+        self.resolved_titles = {}
+
+    @staticmethod
+    def get_chars(title):
+        return set(utils.full_process(title, force_ascii=False)) - {' '}
+
+    @staticmethod
+    def is_mostly_spaces(title):
+        """
+        check all processed versions fuzzywuzzy may compare
+        """
+        processed_title = utils.full_process(title, force_ascii=False)
+        for curr_title in [processed_title,
+                           utils.full_process(title, force_ascii=True),
+                           utils.full_process(processed_title,
+                                              force_ascii=True)]:
+            if curr_title.count(' ') * 2 >= len(curr_title) > 0:
+                return True
+        return False
+
+    def load(self):
+        query = Session.query(Movie.title)
+        self.index_titles([title for title, in query.all()])
+
+    def index_titles(self, titles):
+        self.titles = list(titles)
+        for title_id, title in enumerate(self.titles):
+            if self.is_mostly_spaces(title):
+                self.spaced_title_ids.add(title_id)
+            for char in self.get_chars(title):
+                self.title_ids_by_char[char].add(title_id)
+        self.loaded = True
+
+    def get_candidates(self, title):
+        """
+        titles that may score over 50, in origin order
+        """
+        if self.is_mostly_spaces(title):
+            return self.titles
+        title_ids = set(self.spaced_title_ids)
+        for char in self.get_chars(title):
+            title_ids |= self.title_ids_by_char.get(char, set())
+        return [self.titles[title_id] for title_id in sorted(title_ids)]
+
+    def get_by_title(self, title):
+        """
+        same as Movie.get_by_title but use indexed titles
+        """
+        if title in self.resolved_titles:
+            return self.resolved_titles[title]
+        if not self.loaded:
+            self.load()
+        result_title = None
+        candidates = self.get_candidates(title)
+        # extractOne fails on empty choices, like a new title sharing no
+        # character with stored titles
+        one_item = None
+        if candidates:
+            one_item = process.extractOne(title, candidates)
+        if one_item and one_item[1] > 60:
+            result_title = one_item[0]
+        self.resolved_titles[title] = result_title
+        return result_title
+
+
+# resolver shared in process, showings of all spiders use same movie data
+movie_title_resolver = MovieTitleResolver()
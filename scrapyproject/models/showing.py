@@ -1,12 +1,21 @@
-from sqlalchemy import Column, Integer, String
+from collections import defaultdict
+from sqlalchemy import Column, Integer, String, Index
 from sqlalchemy_utils import ArrowType
 from sqlalchemy import and_
+from sqlalchemy.sql import func, literal_column
+from sqlalchemy.dialects.postgresql import insert
 from scrapyproject.models import Session
 from scrapyproject.models.models import DeclarativeBase
 
 
 class Showing(DeclarativeBase):
     __tablename__ = "showing"
+    __table_args__ = (
+        # natural key of showing, also used to find exist showing
+        Index('ix_showing_natural_key',
+              'cinema_site', 'screen', 'start_time', unique=True,
+              info={'replaces': 'ix_showing_cinema_site_screen_start_time'}),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column('title', String, nullable=False)
@@ -40,3 +49,143 @@ class Showing(DeclarativeBase):
             Showing.start_time < post_start_time))
         result = query.first()
         return result
+
+    @staticmethod
+    def get_report_title(title, merge=False):
+        """
+        SQL expression of title used to group reports, title is normalized
+        with NFKC and movie version in parentheses is removed if merge
+        """
+        title = func.normalize(title, literal_column('NFKC'))
+        if merge:
+            title = func.regexp_replace(title, r'^(.+)\((.+)\)$', r'\1')
+            title = func.regexp_replace(title, r'^\s+|\s+$', '', 'g')
+        return title
+
+    @staticmethod
+    def get_natural_key(item):
+        return (item['cinema_site'], item['screen'],
+                item['start_time'].to('utc'))
+
+    @staticmethod
+    def upsert_items(items, update=False):
+        """
+        Insert showing items in one statement, showings already exist are
+        kept or updated with crawled data if update is True.
+
+        As crawled start times are always whole minutes, natural key
+        conflict is same as rule of get_showing_if_exist.
+        Return ids of inserted or updated showings keyed by natural key.
+        """
+        columns = [x.name for x in Showing.__table__.columns if x.name != 'id']
+        # a row can not be updated twice in one statement, use last one
+        values = {}
+        for item in items:
+            value = dict((x, item.get(x)) for x in columns)
+            if value['total_seat_count'] is None:
+                value['total_seat_count'] = 0
+            values[Showing.get_natural_key(item)] = value
+        if not values:
+            return {}
+        statement = insert(Showing.__table__).values(list(values.values()))
+        key_columns = ['cinema_site', 'screen', 'start_time']
+        if update:
+            statement = statement.on_conflict_do_update(
+                index_elements=key_columns,
+                set_=dict((x, statement.excluded[x]) for x in columns
+                          if x not in key_columns))
+        else:
+            statement = statement.on_conflict_do_nothing(
+                index_elements=key_columns)
+        statement = statement.returning(
+            Showing.__table__.c.id, *[Showing.__table__.c[x]
+                                      for x in key_columns])
+        result = Session.execute(statement)
+        return dict((Showing.get_natural_key(row), row.id) for row in result)
+
+
+class ShowingIndex(object):
+    """
+    In memory index of showings, so that we do not need to query database
+    for every crawled showing.
+
+    Showings are indexed by cinema site, screen and start minute. Showings
+    in a time range should be loaded before searched, searching showing
+    out of loaded time ranges falls back to database query.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.showings = defaultdict(list)
+        self.loaded_ranges = []
+        # showings added after last commit
+        self.pending_showings = []
+
+    @staticmethod
+    def get_key(cinema_site, screen, start_time, minute_shift=0):
+        minute = start_time.timestamp // 60 + minute_shift
+        return (cinema_site, screen, minute)
+
+    def is_loaded(self, time):
+        return any(start_time <= time < end_time
+                   for (start_time, end_time) in self.loaded_ranges)
+
+    def load(self, start_time, end_time):
+        """
+        load all showings start between start_time and end_time
+        """
+        start_time = start_time.to('utc')
+        end_time = end_time.to('utc')
+        if (start_time, end_time) in self.loaded_ranges:
+            return
+        query = Session.query(Showing).filter(and_(
+            Showing.start_time >= start_time,
+            Showing.start_time < end_time))
+        for showing in query.all():
+            self.insert(showing)
+        self.loaded_ranges.append((start_time, end_time))
+
+    def insert(self, showing):
+        start_time = showing.start_time.to('utc')
+        key = self.get_key(showing.cinema_site, showing.screen, start_time)
+        self.showings[key].append((start_time, showing))
+
+    def get_showing_if_exist(self, item):
+        """
+        same as Showing.get_showing_if_exist but search in memory
+        """
+        start_time = item.start_time.to('utc')
+        if not self.is_loaded(start_time):
+            return Showing.get_showing_if_exist(item)
+        pre_start_time = start_time.shift(minutes=-1)
+        post_start_time = start_time.shift(minutes=+1)
+        # showings start within one minute can only be in nearby minutes
+        for minute_shift in (-1, 0, 1):
+            key = self.get_key(item.cinema_site, item.screen, start_time,
+                               minute_shift)
+            for (curr_start_time, showing) in self.showings.get(key, []):
+                if pre_start_time < curr_start_time < post_start_time:
+                    return showing
+        return None
+
+    def add(self, showing):
+        """
+        add showing newly written into session
+        """
+        self.insert(showing)
+        self.pending_showings.append(showing)
+
+    def commit(self):
+        self.pending_showings = []
+
+    def rollback(self):
+        """
+        remove showings added after last commit
+        """
+        for showing in self.pending_showings:
+            key = self.get_key(showing.cinema_site, showing.screen,
+                               showing.start_time.to('utc'))
+            self.showings[key] = [x for x in self.showings[key]
+                                  if x[1] is not showing]
+        self.pending_showings = []
@@ -1,25 +1,195 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+import csv
+import io
+from sqlalchemy import (Column, Integer, String, Boolean, ForeignKey, Index,
+                        false)
 from sqlalchemy_utils import ArrowType
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from scrapyproject.models import Session
 from scrapyproject.models.models import DeclarativeBase
 from scrapyproject.models.showing import Showing
 
 
+# columns of staging table used by copy_from_items, in COPY order
+staging_showing_columns = [
+    'title', 'title_en', 'real_title', 'start_time', 'end_time',
+    'cinema_name', 'cinema_site', 'screen', 'seat_type', 'total_seat_count',
+    'source']
+staging_booking_columns = [
+    'book_status', 'book_seat_count', 'minutes_before', 'record_time',
+    'estimated']
+
+create_staging_sql = """
+CREATE TEMPORARY TABLE showing_booking_staging (
+    row_id serial,
+    title varchar, title_en varchar, real_title varchar,
+    start_time timestamp, end_time timestamp,
+    cinema_name varchar, cinema_site varchar, screen varchar,
+    seat_type varchar, total_seat_count integer, source varchar,
+    book_status varchar, book_seat_count integer, minutes_before integer,
+    record_time timestamp, estimated boolean
+) ON COMMIT DROP
+"""
+
+# same rule as Showing.get_showing_if_exist
+match_showing_sql = """
+    sh.cinema_site = s.cinema_site AND sh.screen = s.screen AND
+    sh.start_time > s.start_time - interval '1 minute' AND
+    sh.start_time < s.start_time + interval '1 minute'
+"""
+
+# exist showings are updated with crawled data, same as pipeline does
+update_showing_sql = """
+UPDATE showing sh SET {set_columns}
+FROM showing_booking_staging s WHERE {match}
+""".format(
+    set_columns=', '.join('{0} = s.{0}'.format(x) for x in
+                          staging_showing_columns
+                          if x != 'total_seat_count') +
+    ', total_seat_count = COALESCE(s.total_seat_count, 0)',
+    match=match_showing_sql)
+
+# staged rows are merged by start minute, same as ShowingIndex keys them
+insert_showing_sql = """
+INSERT INTO showing ({columns})
+SELECT DISTINCT ON (s.cinema_site, s.screen,
+                    date_trunc('minute', s.start_time)) {select_columns}
+FROM showing_booking_staging s
+WHERE NOT EXISTS (SELECT 1 FROM showing sh WHERE {match})
+ORDER BY s.cinema_site, s.screen, date_trunc('minute', s.start_time),
+    s.row_id DESC
+RETURNING id
+""".format(
+    columns=', '.join(staging_showing_columns),
+    select_columns=', '.join(
+        'COALESCE(s.total_seat_count, 0)' if x == 'total_seat_count' else
+        's.' + x for x in staging_showing_columns),
+    match=match_showing_sql)
+
+insert_booking_sql = """
+INSERT INTO showing_booking (showing_id, {columns})
+SELECT DISTINCT ON (s.row_id) sh.id, s.book_status,
+    COALESCE(s.book_seat_count, 0), s.minutes_before, s.record_time,
+    COALESCE(s.estimated, false)
+FROM showing_booking_staging s JOIN showing sh ON {match}
+ORDER BY s.row_id, sh.id
+""".format(
+    columns=', '.join(staging_booking_columns),
+    match=match_showing_sql)
+
+
+def to_database_time(time):
+    """
+    convert arrow object to naive utc time text as ArrowType stores
+    """
+    if not time:
+        return None
+    return time.to('UTC').naive.isoformat()
+
+
 class ShowingBooking(DeclarativeBase):
     __tablename__ = "showing_booking"
+    __table_args__ = (
+        Index('ix_showing_booking_showing_id_record_time',
+              'showing_id', 'record_time'),
+        # partitioned by month of record time, so that old data can be
+        # dropped by partition and queries by time only scan some months
+        {'info': {'partition_by': 'record_time'}},
+    )
 
-    id = Column(Integer, primary_key=True)
+    # partition key must be part of primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
     showing_id = Column(Integer, ForeignKey("showing.id"))
     showing = relationship("Showing")
     book_status = Column('book_status', String, nullable=False)
     book_seat_count = Column('book_seat_count', Integer, default=0,
                              nullable=False)
     minutes_before = Column('minutes_before', Integer, nullable=False)
-    record_time = Column('record_time', ArrowType, nullable=False)
+    record_time = Column('record_time', ArrowType, primary_key=True)
+    # book seat count is estimated from book status instead of crawled
+    estimated = Column('estimated', Boolean, default=False, nullable=False,
+                       server_default=false())
 
     def from_item(self, item):
         self.book_status = item['book_status']
         self.book_seat_count = item['book_seat_count']
         self.minutes_before = item['minutes_before']
         self.record_time = item['record_time']
+        self.estimated = bool(item.get('estimated'))
         self.showing = Showing(**(item['showing']))
+
+    @staticmethod
+    def copy_from_items(items):
+        """
+        Bulk insert showing booking items.
+
+        Items are loaded into a staging table with COPY, then showing of
+        each item is found or created and bookings are inserted with
+        a few set based statements.
+        This runs in global session's transaction and caller should commit.
+        Return showings newly inserted, loaded into session.
+        """
+        staging_file = io.StringIO()
+        # quote strings so that only None is treated as NULL
+        writer = csv.writer(staging_file, quoting=csv.QUOTE_NONNUMERIC)
+        for item in items:
+            showing = item['showing']
+            row = [showing.get(x) for x in staging_showing_columns]
+            row += [item.get(x) for x in staging_booking_columns]
+            for idx, column in enumerate(staging_showing_columns +
+                                         staging_booking_columns):
+                if column in ('start_time', 'end_time', 'record_time'):
+                    row[idx] = to_database_time(row[idx])
+            writer.writerow(row)
+        staging_file.seek(0)
+        connection = Session.connection()
+        connection.execute(create_staging_sql)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            "COPY showing_booking_staging ({columns}) FROM STDIN "
+            "WITH CSV".format(columns=', '.join(
+                staging_showing_columns + staging_booking_columns)),
+            staging_file)
+        connection.execute(update_showing_sql)
+        showing_ids = [row.id for row in connection.execute(
+            insert_showing_sql)]
+        connection.execute(insert_booking_sql)
+        if not showing_ids:
+            return []
+        return Session.query(Showing).filter(
+            Showing.id.in_(showing_ids)).all()
+
+    @staticmethod
+    def upsert_items(items):
+        """
+        Bulk insert showing booking items.
+
+        Showings of items are inserted or updated in one statement, then
+        bookings are inserted with their ids.
+        This runs in global session's transaction and caller should commit.
+        """
+        showing_ids = Showing.upsert_items(
+            [item['showing'] for item in items], update=True)
+        values = []
+        for item in items:
+            value = dict((x, item.get(x)) for x in staging_booking_columns)
+            if value['book_seat_count'] is None:
+                value['book_seat_count'] = 0
+            value['estimated'] = bool(value['estimated'])
+            value['showing_id'] = showing_ids[
+                Showing.get_natural_key(item['showing'])]
+            values.append(value)
+        if values:
+            Session.execute(ShowingBooking.__table__.insert(), values)
+
+    @staticmethod
+    def get_watermark():
+        """
+        latest written ids, changed whenever new crawled data lands, and
+        oldest booking id, changed when old partitions are dropped.
+        max record_time is not used as it is not indexed
+        """
+        (min_booking_id, max_booking_id) = Session.query(
+            func.min(ShowingBooking.id), func.max(ShowingBooking.id)).one()
+        (showing_id,) = Session.query(func.max(Showing.id)).one()
+        return (min_booking_id, max_booking_id, showing_id)
@@ -0,0 +1,291 @@
+from sqlalchemy import (Column, Integer, Date, Interval, ForeignKey, Index,
+                        and_, case, cast, literal_column, select, union_all)
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from scrapyproject.models import Session
+from scrapyproject.models.models import DeclarativeBase
+from scrapyproject.models.showing import Showing
+from scrapyproject.models.showing_booking import ShowingBooking
+from scrapyproject.models.booking_rollup import show_date_offset_hours
+
+
+# minutes before start that booked seats are kept for compacted showings
+checkpoint_minutes = [10080, 4320, 1440, 720, 360, 180, 60, 30, 0]
+
+# merge rows of a showing booking partition into summaries, rows of later
+# partitions are closer to start so their final count and checkpoints win
+summarize_partition_sql = """
+INSERT INTO showing_booking_summary (
+    showing_id, final_book_seat_count, peak_book_seat_count,
+    showing_booking_count, book_seat_count_sum, estimated_booking_count,
+    checkpoints)
+SELECT sb.showing_id,
+    (array_agg(sb.book_seat_count ORDER BY sb.minutes_before))[1],
+    MAX(sb.book_seat_count), COUNT(*), SUM(sb.book_seat_count),
+    COUNT(*) FILTER (WHERE sb.estimated),
+    jsonb_strip_nulls(jsonb_build_object({checkpoints}))
+FROM {partition} sb
+GROUP BY sb.showing_id
+ON CONFLICT (showing_id) DO UPDATE SET
+    final_book_seat_count = excluded.final_book_seat_count,
+    peak_book_seat_count = GREATEST(
+        showing_booking_summary.peak_book_seat_count,
+        excluded.peak_book_seat_count),
+    showing_booking_count = showing_booking_summary.showing_booking_count +
+        excluded.showing_booking_count,
+    book_seat_count_sum = showing_booking_summary.book_seat_count_sum +
+        excluded.book_seat_count_sum,
+    estimated_booking_count =
+        showing_booking_summary.estimated_booking_count +
+        excluded.estimated_booking_count,
+    checkpoints = showing_booking_summary.checkpoints || excluded.checkpoints
+"""
+# book seat count of latest snapshot not later than a checkpoint
+checkpoint_sql = """'{0}', (array_agg(sb.book_seat_count
+        ORDER BY sb.minutes_before) FILTER (
+        WHERE sb.minutes_before >= {0}))[1]"""
+
+# dimensions of get_dimension_totals and their GROUPING() results of
+# (cinema_name, source, show_date)
+report_dimensions = [('cinema', 0b011), ('source', 0b101),
+                     ('show_date', 0b110), ('total', 0b111)]
+
+
+class ShowingBookingSummary(DeclarativeBase):
+    """
+    showing booking rows of a showing collapsed into one row, used for
+    old showings so that their raw rows can be deleted
+    """
+    __tablename__ = "showing_booking_summary"
+    __table_args__ = (
+        Index('ix_showing_booking_summary_showing_id', 'showing_id',
+              unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    showing_id = Column(Integer, ForeignKey("showing.id"), nullable=False)
+    showing = relationship("Showing")
+    # book seat count of snapshot nearest to start
+    final_book_seat_count = Column('final_book_seat_count', Integer,
+                                   nullable=False)
+    peak_book_seat_count = Column('peak_book_seat_count', Integer,
+                                  nullable=False)
+    # count and book seat count sum of collapsed rows, so that totals
+    # summing raw rows still work
+    showing_booking_count = Column('showing_booking_count', Integer,
+                                   nullable=False)
+    book_seat_count_sum = Column('book_seat_count_sum', Integer,
+                                 nullable=False)
+    estimated_booking_count = Column('estimated_booking_count', Integer,
+                                     default=0, nullable=False,
+                                     server_default='0')
+    # book seat count of latest snapshot not later than each checkpoint,
+    # keyed by minutes before start
+    checkpoints = Column('checkpoints', JSONB, nullable=False)
+
+    @staticmethod
+    def summarize(snapshots):
+        """
+        summarize (minutes_before, book_seat_count, estimated) snapshots of
+        a showing
+        """
+        snapshots = sorted(snapshots)
+        book_seat_counts = [count for _, count, _ in snapshots]
+        checkpoints = {}
+        for checkpoint in checkpoint_minutes:
+            for minutes_before, count, _ in snapshots:
+                if minutes_before >= checkpoint:
+                    checkpoints[str(checkpoint)] = count
+                    break
+        return {
+            'final_book_seat_count': book_seat_counts[0],
+            'peak_book_seat_count': max(book_seat_counts),
+            'showing_booking_count': len(snapshots),
+            'book_seat_count_sum': sum(book_seat_counts),
+            'estimated_booking_count': sum(
+                1 for _, _, estimated in snapshots if estimated),
+            'checkpoints': checkpoints,
+        }
+
+    @staticmethod
+    def merge_values(exist, value):
+        """
+        merge summary of rows collapsed earlier, earlier values are kept
+        """
+        checkpoints = dict(value['checkpoints'])
+        checkpoints.update(exist.checkpoints)
+        return {
+            'final_book_seat_count': exist.final_book_seat_count,
+            'peak_book_seat_count': max(exist.peak_book_seat_count,
+                                        value['peak_book_seat_count']),
+            'showing_booking_count': (exist.showing_booking_count +
+                                      value['showing_booking_count']),
+            'book_seat_count_sum': (exist.book_seat_count_sum +
+                                    value['book_seat_count_sum']),
+            'estimated_booking_count': (exist.estimated_booking_count +
+                                        value['estimated_booking_count']),
+            'checkpoints': checkpoints,
+        }
+
+    @staticmethod
+    def get_partition_summary_sql(name):
+        """
+        statement merging rows of showing booking partition into summaries
+        like compact, rows are not deleted as partition is dropped after
+        """
+        return summarize_partition_sql.format(
+            partition=name, checkpoints=', '.join(
+                checkpoint_sql.format(x) for x in checkpoint_minutes))
+
+    @staticmethod
+    def compact(showing_ids):
+        """
+        collapse showing booking rows of showings into summaries and delete
+        them. This runs in global session's transaction and caller should
+        commit, return count of deleted rows.
+        """
+        query = Session.query(
+            ShowingBooking.showing_id, ShowingBooking.minutes_before,
+            ShowingBooking.book_seat_count, ShowingBooking.estimated
+            ).filter(ShowingBooking.showing_id.in_(showing_ids))
+        snapshots = {}
+        for (showing_id, minutes_before, book_seat_count,
+             estimated) in query:
+            snapshots.setdefault(showing_id, []).append(
+                (minutes_before, book_seat_count, estimated))
+        if not snapshots:
+            return 0
+        exist_summaries = dict(
+            (x.showing_id, x) for x in Session.query(
+                ShowingBookingSummary).filter(
+                    ShowingBookingSummary.showing_id.in_(
+                        list(snapshots.keys()))))
+        values = []
+        for showing_id, curr_snapshots in snapshots.items():
+            value = ShowingBookingSummary.summarize(curr_snapshots)
+            if showing_id in exist_summaries:
+                value = ShowingBookingSummary.merge_values(
+                    exist_summaries[showing_id], value)
+            value['showing_id'] = showing_id
+            values.append(value)
+        table = ShowingBookingSummary.__table__
+        statement = insert(table).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=['showing_id'],
+            set_=dict((x, statement.excluded[x]) for x in values[0]
+                      if x != 'showing_id'))
+        Session.execute(statement)
+        return Session.query(ShowingBooking).filter(
+            ShowingBooking.showing_id.in_(list(snapshots.keys()))
+            ).delete(synchronize_session=False)
+
+    @staticmethod
+    def get_booking_totals(start_time=None, end_time=None):
+        """
+        subquery of booking sums per showing from raw rows and summaries,
+        columns are showing_id, book_seat_count, count and estimated_count.
+        bookings can be limited to those recorded between start_time and
+        end_time, so that only their partitions are scanned, summaries are
+        limited by showing start time instead
+        """
+        raw = select([
+            ShowingBooking.showing_id.label('showing_id'),
+            func.sum(ShowingBooking.book_seat_count).label(
+                'book_seat_count'),
+            func.count(ShowingBooking.id).label('count'),
+            func.count(ShowingBooking.id).filter(
+                ShowingBooking.estimated).label('estimated_count')
+            ]).group_by(ShowingBooking.showing_id)
+        summary = select([
+            ShowingBookingSummary.showing_id,
+            ShowingBookingSummary.book_seat_count_sum,
+            ShowingBookingSummary.showing_booking_count,
+            ShowingBookingSummary.estimated_booking_count])
+        if start_time is not None:
+            raw = raw.where(ShowingBooking.record_time >= start_time)
+            summary = summary.where(and_(
+                ShowingBookingSummary.showing_id == Showing.id,
+                Showing.start_time >= start_time))
+        if end_time is not None:
+            raw = raw.where(ShowingBooking.record_time < end_time)
+            summary = summary.where(and_(
+                ShowingBookingSummary.showing_id == Showing.id,
+                Showing.start_time < end_time))
+        return union_all(raw, summary).alias('bookings')
+
+    @staticmethod
+    def get_showing_totals(cinema_name=None, merge=False, start_time=None,
+                           end_time=None):
+        """
+        query booking sums per showing, ordered by start time, see
+        Showing.get_report_title and get_booking_totals
+        """
+        bookings = ShowingBookingSummary.get_booking_totals(
+            start_time, end_time)
+        title = Showing.get_report_title(
+            Showing.title, merge).label("report_title")
+        query = Session.query(
+            title,
+            Showing.cinema_name,
+            Showing.screen,
+            Showing.start_time,
+            func.sum(bookings.c.book_seat_count),
+            func.sum(Showing.total_seat_count * bookings.c.count),
+            func.sum(bookings.c.count),
+            func.sum(bookings.c.estimated_count)
+            ).filter(
+                bookings.c.showing_id == Showing.id
+            ).group_by(Showing.id).order_by(Showing.start_time, Showing.id)
+        if cinema_name is not None:
+            query = query.filter(Showing.cinema_name == cinema_name)
+        return query
+
+    @staticmethod
+    def get_dimension_totals(cinema_name=None, merge=False, start_time=None,
+                             end_time=None):
+        """
+        query booking sums per title and cinema, per title and source, per
+        title and show date and per title in one pass with GROUPING SETS.
+        first column is dimension name of each row, one of report_dimensions
+        """
+        bookings = ShowingBookingSummary.get_booking_totals(
+            start_time, end_time)
+        rows = select([
+            Showing.get_report_title(Showing.title, merge).label('title'),
+            Showing.cinema_name.label('cinema_name'),
+            Showing.source.label('source'),
+            cast(Showing.start_time + literal_column(
+                "interval '{0} hours'".format(show_date_offset_hours),
+                type_=Interval), Date).label('show_date'),
+            bookings.c.book_seat_count.label('book_seat_count'),
+            (Showing.total_seat_count * bookings.c.count).label(
+                'total_seat_count'),
+            bookings.c.count.label('count'),
+            bookings.c.estimated_count.label('estimated_count')
+            ]).where(bookings.c.showing_id == Showing.id)
+        if cinema_name is not None:
+            rows = rows.where(Showing.cinema_name == cinema_name)
+        rows = rows.alias('report_rows')
+        # each bit is 1 if the column is not grouped in the row
+        grouping = func.grouping(rows.c.cinema_name, rows.c.source,
+                                 rows.c.show_date).label('grouping')
+        dimension = case(
+            [(grouping == bits, name) for name, bits in report_dimensions],
+            else_=None).label('dimension')
+        book_count_label = func.sum(rows.c.book_seat_count).label(
+            'book_count')
+        return Session.query(
+            dimension,
+            rows.c.title,
+            rows.c.cinema_name,
+            rows.c.source,
+            rows.c.show_date,
+            book_count_label,
+            func.sum(rows.c.total_seat_count),
+            func.sum(rows.c.count),
+            func.sum(rows.c.estimated_count)
+            ).group_by(literal_column(
+                'GROUPING SETS ((title, cinema_name), (title, source), '
+                '(title, show_date), (title))')
+            ).order_by(grouping, book_count_label.desc())
@@ -4,9 +4,17 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
-from scrapyproject.models import (Cinema, Showing, ShowingBooking, Movie,
+from collections import OrderedDict
+from twisted.internet import reactor, task, threads
+from twisted.python.threadpool import ThreadPool
+from scrapyproject.models import (Cinema, CinemaReconciler, Showing,
+                                  ShowingIndex, ShowingBooking,
+                                  BookingRollup, Movie,
+                                  cinema_catalog, booking_estimator,
+                                  movie_title_resolver, configure_engine,
                                   db_connect, drop_table_if_exist,
-                                  create_table, Session)
+                                  create_table, get_missing_unique_indexes,
+                                  Session)
 from scrapyproject.items import (CinemaItem, ShowingItem, ShowingBookingItem,
                                  MovieItem)
 from scrapyproject.utils import (use_cinema_database,
@@ -14,38 +22,250 @@ from scrapyproject.utils import (use_cinema_database,
                                  use_movie_database)
 
 
+class PendingItems(object):
+    """
+    items written into global session but not yet committed.
+    items are grouped by type and kept in the order they should be
+    written, as showing booking items may refer to crawled showings.
+    items to be written in bulk on commit, like COPY and upsert, are kept
+    apart as they are not in session.
+    """
+    item_types = (ShowingItem, ShowingBookingItem, MovieItem)
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return sum(len(x) for x in self.items.values()) + sum(
+            len(x) for x in self.bulk_items.values())
+
+    def clear(self):
+        self.items = OrderedDict((x, []) for x in self.item_types)
+        self.bulk_items = OrderedDict((x, []) for x in self.item_types)
+
+    def add(self, item, spider):
+        self.items[type(item)].append((item, spider))
+
+    def add_bulk(self, item, spider):
+        self.bulk_items[type(item)].append((item, spider))
+
+    def max_count(self):
+        """
+        item count of the largest group
+        """
+        return max(len(x) for x in (list(self.items.values()) +
+                                    list(self.bulk_items.values())))
+
+    def get_items(self, item_type):
+        """
+        return all pending items of item_type, written in bulk or not
+        """
+        return [item for item, _ in (self.items[item_type] +
+                                     self.bulk_items[item_type])]
+
+    def pop_all(self):
+        """
+        return all pending (item, spider) pairs in write order and clear
+        """
+        for item_type in self.item_types:
+            self.items[item_type].extend(self.bulk_items[item_type])
+        result = [x for curr_items in self.items.values() for x in curr_items]
+        self.clear()
+        return result
+
+
+class DatabaseWriter(object):
+    """
+    run database work on one dedicated thread in submitted order, so that
+    reactor thread is not blocked by database.
+    as global session is scoped by thread, all work shares one session.
+    writer is full when queue_size works are pending, callers should wait
+    for their work then so that queue stops growing.
+    """
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.pending_count = 0
+        self.thread_pool = None
+
+    def start(self):
+        if self.thread_pool:
+            return
+        self.thread_pool = ThreadPool(minthreads=1, maxthreads=1,
+                                      name='database')
+        self.thread_pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown',
+                                      self.thread_pool.stop)
+
+    def is_full(self):
+        return self.pending_count >= self.queue_size
+
+    def run(self, func, *args, **kwargs):
+        """
+        run func in writer thread, return deferred fired with its result
+        """
+        self.pending_count += 1
+        d = threads.deferToThreadPool(reactor, self.thread_pool, func,
+                                      *args, **kwargs)
+        d.addBoth(self.finish)
+        return d
+
+    def finish(self, result):
+        self.pending_count -= 1
+        return result
+
+
 class DataBasePipeline(object):
     """
     pipeline to add item to database
     will keep exist data if spider has attribute 'keep_old_data'
+
+    items are written into global session as they come and committed in
+    batches, when DATABASE_BATCH_SIZE items of one type are pending, every
+    DATABASE_FLUSH_INTERVAL seconds and when spider closes.
+    cinema items are merged in memory and written when spider closes.
+    booking rollup is updated in the same transaction as showing bookings.
+    if DATABASE_UPSERT is set, showing, showing booking and movie items are
+    written with INSERT ... ON CONFLICT when committed instead. cinema items
+    are not, as they are merged with exist cinemas by CinemaReconciler.
+    if DATABASE_COPY_SHOWING_BOOKING is set, showing booking items are
+    written with COPY when committed instead.
+    all database work runs in writer thread, open_spider and close_spider
+    return deferred fired when the work is done, process_item only waits
+    for it when writer is full.
     """
-    def __init__(self, database):
+    # global session is shared by all spiders running in one process, so
+    # items pending in it should be shared too
+    pending_items = PendingItems()
+    # crawled and exist showings, used to avoid querying for every showing
+    showing_index = ShowingIndex()
+    # crawled and exist cinemas, written when spider closes
+    cinema_reconciler = CinemaReconciler()
+    # writer thread shared by all spiders, created with first pipeline
+    writer = None
+    # count of open spiders, global session is removed when all are closed
+    open_count = 0
+
+    def __init__(self, database, stats, batch_size=500, flush_interval=30,
+                 upsert=False, copy_showing_booking=False,
+                 partition_months_ahead=None):
         self.database = database
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.upsert = upsert
+        self.copy_showing_booking = copy_showing_booking
+        self.partition_months_ahead = partition_months_ahead
+        self.flush_task = None
         # keep crawled movie to sum cinema count
         self.crawled_movies = {}
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(database=crawler.settings.get('DATABASE'))
+        if cls.writer is None:
+            cls.writer = DatabaseWriter(
+                crawler.settings.getint('DATABASE_QUEUE_SIZE', 1000))
+            # keep a connection for every crawler in process, and allow
+            # burst up to concurrent request count
+            crawler_count = crawler.settings.getint(
+                'DATABASE_CRAWLER_COUNT', 1)
+            configure_engine(
+                pool_size=crawler_count,
+                max_overflow=crawler.settings.getint('CONCURRENT_REQUESTS'))
+        return cls(
+            database=crawler.settings.get('DATABASE'),
+            stats=crawler.stats,
+            batch_size=crawler.settings.getint('DATABASE_BATCH_SIZE', 500),
+            flush_interval=crawler.settings.getfloat(
+                'DATABASE_FLUSH_INTERVAL', 30),
+            upsert=crawler.settings.getbool('DATABASE_UPSERT'),
+            copy_showing_booking=crawler.settings.getbool(
+                'DATABASE_COPY_SHOWING_BOOKING'),
+            partition_months_ahead=crawler.settings.getint(
+                'DATABASE_PARTITION_MONTHS_AHEAD'))
 
     def open_spider(self, spider):
+        DataBasePipeline.open_count += 1
+        self.writer.start()
+        d = self.writer.run(self.open_database, spider)
+        d.addCallback(lambda _: self.start_flush_task())
+        return d
+
+    def open_database(self, spider):
         engine = db_connect()
         if not spider.keep_old_data:
             # drop data
             if use_showing_database(spider):
+                drop_table_if_exist(engine, BookingRollup)
                 drop_table_if_exist(engine, ShowingBooking)
                 drop_table_if_exist(engine, Showing)
+                self.showing_index.clear()
             elif use_cinema_database(spider):
                 drop_table_if_exist(engine, Cinema)
+                self.cinema_reconciler.clear()
             elif use_movie_database(spider):
                 drop_table_if_exist(engine, Movie)
-        create_table(engine)
+        # partitions are created before their months come, so that crawls
+        # started late in a month or after a long pause still write into
+        # monthly partitions
+        create_table(engine, self.partition_months_ahead)
+        if self.upsert:
+            # ON CONFLICT needs unique natural key indexes, which are not
+            # created on tables with duplicate rows
+            for table in (Showing.__table__, Movie.__table__):
+                missing_indexes = get_missing_unique_indexes(engine, table)
+                if missing_indexes:
+                    raise RuntimeError(
+                        'DATABASE_UPSERT needs unique index {0} of table {1},'
+                        ' remove duplicate rows and restart'.format(
+                            ', '.join(missing_indexes), table.name))
+        if use_cinema_database(spider) and not self.cinema_reconciler.loaded:
+            self.cinema_reconciler.load()
+        if use_showing_database(spider):
+            if not self.upsert:
+                start_time, end_time = spider.get_crawl_time_range()
+                self.showing_index.load(start_time, end_time)
+            # load data used by item loaders here, so that spiders do not
+            # query database in reactor thread
+            if not cinema_catalog.loaded:
+                cinema_catalog.load()
+            if not movie_title_resolver.loaded:
+                movie_title_resolver.load()
+            if (getattr(spider, 'booking_mode', None) == 'estimate' and
+                    not booking_estimator.loaded):
+                booking_estimator.load()
+
+    def start_flush_task(self):
+        if self.batch_size > 1 and self.flush_interval > 0:
+            self.flush_task = task.LoopingCall(self.writer.run,
+                                               self.flush_items)
+            self.flush_task.start(self.flush_interval, now=False)
 
     def close_spider(self, spider):
-        for title in self.crawled_movies:
-            self.process_movie_item(self.crawled_movies[title], spider)
-        # close global session when spider ends
-        Session.remove()
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        DataBasePipeline.open_count -= 1
+        d = self.writer.run(self.close_database, spider,
+                            list(self.crawled_movies.values()),
+                            DataBasePipeline.open_count == 0)
+        d.addCallback(lambda _: self.update_stats(spider))
+        return d
+
+    def close_database(self, spider, movie_items, is_last):
+        self.write_cinemas(spider)
+        for item in movie_items:
+            self.write_item(item, spider)
+        self.flush_items()
+        # other spiders still write through global session and its cached
+        # objects, close it when last spider ends
+        if is_last:
+            Session.remove()
+
+    def update_stats(self, spider):
+        # catalog is shared in process, so counts include all spiders
+        self.stats.set_value('cinema_catalog/hit_count',
+                             cinema_catalog.hit_count, spider=spider)
+        self.stats.set_value('cinema_catalog/miss_count',
+                             cinema_catalog.miss_count, spider=spider)
 
     def process_item(self, item, spider):
         """
@@ -54,11 +274,8 @@ class DataBasePipeline(object):
         a spider should not have both attributes
         """
         if isinstance(item, CinemaItem):
-            return self.process_cinema_item(item, spider)
-        elif isinstance(item, ShowingItem):
-            return self.process_showing_item(item, spider)
-        elif isinstance(item, ShowingBookingItem):
-            return self.process_showing_booking_item(item, spider)
+            d = self.writer.run(self.process_cinema_item, item, spider)
+            return self.wait_if_full(d, item, spider)
         elif isinstance(item, MovieItem):
             # sum cinema count for each cinema
             if item['title'] not in self.crawled_movies:
@@ -68,13 +285,140 @@ class DataBasePipeline(object):
                          self.crawled_movies[item['title']]['current_cinema_count'])
                 self.crawled_movies[item['title']]['current_cinema_count'] = count
             return item
+        d = self.writer.run(self.write_item, item, spider)
+        return self.wait_if_full(d, item, spider)
+
+    def wait_if_full(self, d, item, spider):
+        """
+        pass item on at once unless writer is full, then engine waits for
+        the write of item
+        """
+        if self.writer.is_full():
+            d.addCallback(lambda _: item)
+            return d
+        d.addErrback(lambda failure: spider.logger.error(
+            'failed to write item: %s\n%s', item, failure.getTraceback()))
+        return item
+
+    def write_item(self, item, spider):
+        """
+        write item into global session and commit if batch is full
+        """
+        if self.is_bulk_item(item):
+            # written in bulk when committed
+            self.pending_items.add_bulk(item, spider)
+        else:
+            self.pending_items.add(item, spider)
+            try:
+                self.add_item_to_session(item, spider)
+            except Exception:
+                # error may also come from autoflush of earlier pending
+                # items, so roll back and retry all of them
+                Session.rollback()
+                self.showing_index.rollback()
+                self.retry_items()
+                return
+        if self.pending_items.max_count() >= self.batch_size:
+            self.flush_items()
+
+    def is_bulk_item(self, item):
+        if isinstance(item, ShowingBookingItem):
+            return self.copy_showing_booking or self.upsert
+        elif isinstance(item, (ShowingItem, MovieItem)):
+            return self.upsert
+        return False
+
+    def write_bulk_items(self, item_type, items):
+        if item_type is ShowingItem:
+            Showing.upsert_items(items)
+        elif item_type is ShowingBookingItem:
+            if self.copy_showing_booking:
+                # later items of crawl should find showings inserted by COPY
+                for showing in ShowingBooking.copy_from_items(items):
+                    self.showing_index.add(showing)
+            else:
+                ShowingBooking.upsert_items(items)
+        elif item_type is MovieItem:
+            Movie.upsert_items(items)
+
+    def add_item_to_session(self, item, spider):
+        if isinstance(item, ShowingItem):
+            return self.process_showing_item(item, spider)
+        elif isinstance(item, ShowingBookingItem):
+            return self.process_showing_booking_item(item, spider)
+        elif isinstance(item, MovieItem):
+            return self.process_movie_item(item, spider)
+
+    def flush_items(self):
+        """
+        commit all pending items in one transaction.
+        if it fails, roll back and retry items one by one so that only
+        failed items are dropped, items written in bulk are retried with ORM.
+        """
+        if not len(self.pending_items):
+            return
+        try:
+            # make items in session visible to bulk statements
+            Session.flush()
+            for item_type, items in self.pending_items.bulk_items.items():
+                if items:
+                    self.write_bulk_items(
+                        item_type, [item for item, _ in items])
+            BookingRollup.add_items(
+                self.pending_items.get_items(ShowingBookingItem))
+            Session.commit()
+        except Exception:
+            Session.rollback()
+            self.showing_index.rollback()
+            self.retry_items()
+        else:
+            self.pending_items.clear()
+            self.showing_index.commit()
+
+    def write_cinemas(self, spider):
+        """
+        write all changed cinemas in one transaction, if it fails, roll back
+        and retry cinemas one by one
+        """
+        cinemas = self.cinema_reconciler.get_changed_cinemas()
+        if not cinemas:
+            return
+        try:
+            new_mappings = self.cinema_reconciler.write(cinemas)
+            Session.commit()
+            self.cinema_reconciler.mark_written(cinemas, new_mappings)
+            return
+        except Exception:
+            Session.rollback()
+        for cinema in cinemas:
+            try:
+                new_mappings = self.cinema_reconciler.write([cinema])
+                Session.commit()
+                self.cinema_reconciler.mark_written([cinema], new_mappings)
+            except Exception:
+                Session.rollback()
+                spider.logger.exception(
+                    'failed to write cinema: %s', cinema.names)
+
+    def retry_items(self):
+        for item, spider in self.pending_items.pop_all():
+            try:
+                self.add_item_to_session(item, spider)
+                if isinstance(item, ShowingBookingItem):
+                    BookingRollup.add_items([item])
+                Session.commit()
+                self.showing_index.commit()
+            except Exception:
+                Session.rollback()
+                self.showing_index.rollback()
+                spider.logger.exception('failed to write item: %s', item)
 
     def process_cinema_item(self, item, spider):
         cinema = Cinema(**item)
-        exist_cinema = Cinema.get_cinema_if_exist(cinema)
+        exist_cinema = self.cinema_reconciler.get_cinema_if_exist(cinema)
         if not exist_cinema:
             # if data do not exist in database, add it
-            self.add_item_to_database(cinema)
+            self.cinema_reconciler.update(cinema)
         else:
             # otherwise check if it should be merged to exist record
             # merge strategy:
@@ -91,18 +435,19 @@ class DataBasePipeline(object):
                 else:
                     exist_cinema.merge(
                         cinema, merge_method=Cinema.MergeMethod.info_only)
-                self.add_item_to_database(exist_cinema)
+                self.cinema_reconciler.update(exist_cinema)
             elif cinema.site:
                 exist_cinema.merge(
                     cinema, merge_method=Cinema.MergeMethod.update_count)
-                self.add_item_to_database(exist_cinema)
+                self.cinema_reconciler.update(exist_cinema)
         return item
 
     def process_showing_item(self, item, spider):
         showing = Showing(**item)
         # if data do not exist in database, add it
-        if not Showing.get_showing_if_exist(showing):
-            self.add_item_to_database(showing)
+        if not self.showing_index.get_showing_if_exist(showing):
+            showing = self.add_item_to_database(showing)
+            self.showing_index.add(showing)
         return item
 
     def process_showing_booking_item(self, item, spider):
@@ -110,7 +455,8 @@ class DataBasePipeline(object):
         showing_booking.from_item(item)
 
         # if showing exists use its id in database
-        exist_showing = Showing.get_showing_if_exist(showing_booking.showing)
+        exist_showing = self.showing_index.get_showing_if_exist(
+            showing_booking.showing)
         if exist_showing:
             old_showing = showing_booking.showing
             showing_booking.showing = exist_showing
@@ -126,7 +472,9 @@ class DataBasePipeline(object):
                 old_showing.total_seat_count
             showing_booking.showing.source = old_showing.source
         # then add self
-        self.add_item_to_database(showing_booking)
+        showing_booking = self.add_item_to_database(showing_booking)
+        if not exist_showing:
+            self.showing_index.add(showing_booking.showing)
         return item
 
     def process_movie_item(self, item, spider):
@@ -137,9 +485,8 @@ class DataBasePipeline(object):
         return item
 
     def add_item_to_database(self, db_item):
-        try:
-            db_item = Session.merge(db_item)
-            Session.commit()
-        except:
-            Session.rollback()
-            raise
+        """
+        add item to global session, it is committed in flush_items.
+        return the instance in session
+        """
+        return Session.merge(db_item)
@@ -73,10 +73,32 @@ DOWNLOADER_MIDDLEWARES = {
     'scrapyproject.middlewares.selenium.SeleniumDownloaderMiddleware': 543,
     'scrapyproject.middlewares.cookies.CustomCookiesMiddleware': 700,
     'scrapyproject.middlewares.proxy.ProxyDownloaderMiddleware': 751,
+    'scrapyproject.middlewares.concurrency.AdaptiveConcurrencyMiddleware': 800,
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None
 }
 
+# adapt concurrency of each spider to latency and errors, see
+# AdaptiveConcurrencyMiddleware
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_START = 4
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 16
+# seconds, concurrency stops growing when average latency is above it
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0
+
+# showing spiders keep schedule ids of cinemas here to skip cinema pages,
+# see CinemaDirectoryCache
+DIRECTORY_CACHE_ENABLED = True
+# not under data_handler.py result cache directory, which is evicted
+DIRECTORY_CACHE_DIR = '.directory_cache'
+# seconds before cached schedule ids are crawled again
+DIRECTORY_CACHE_TTL = 7 * 24 * 3600
+
+# max count of sessions kept per cinema by spiders crawling booking data
+# with session pool (aeon), see SessionPool
+SESSION_POOL_SIZE = 2
+
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
@@ -99,6 +121,24 @@ DATABASE = {
     'password': os.environ['POSTGRES_PASSWORD'],
     'database': os.environ['POSTGRES_DB']
 }
+# max count of items of one type committed in a single transaction,
+# use 1 to commit every item
+DATABASE_BATCH_SIZE = 500
+# max seconds crawled items wait before committed
+DATABASE_FLUSH_INTERVAL = 30
+# write showing, showing booking and movie items with INSERT ... ON CONFLICT
+# instead of ORM
+DATABASE_UPSERT = False
+# write showing booking items with COPY instead of ORM
+DATABASE_COPY_SHOWING_BOOKING = False
+# items are passed on without waiting for database writer thread until
+# this many works are queued, then pipeline waits for each write so that
+# engine scrapes slower
+DATABASE_QUEUE_SIZE = 1000
+# monthly showing booking partitions are created this many months ahead
+# by create_table, rows of months without partition go to default
+# partition and block creating it later
+DATABASE_PARTITION_MONTHS_AHEAD = 2
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
@@ -112,7 +152,10 @@ LOG_LEVEL = 'INFO'
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
-AUTOTHROTTLE_ENABLED = True
+# AutoThrottle delays would fight AdaptiveConcurrencyMiddleware over the
+# same latency, adaptive concurrency wins and AutoThrottle is only used
+# when it is disabled
+AUTOTHROTTLE_ENABLED = not ADAPTIVE_CONCURRENCY_ENABLED
 # The initial download delay
 #AUTOTHROTTLE_START_DELAY = 5
 # The maximum download delay to be set in case of high latencies
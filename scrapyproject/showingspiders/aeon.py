@@ -6,7 +6,7 @@ import demjson
 import scrapy
 from scrapyproject.showingspiders.showing_spider import ShowingSpider
 from scrapyproject.items import (ShowingLoader, init_show_booking_loader)
-from scrapyproject.utils import AeonUtil
+from scrapyproject.utils import AeonUtil, SessionPool
 
 
 class AeonSpider(ShowingSpider):
@@ -19,9 +19,39 @@ class AeonSpider(ShowingSpider):
         'http://www.aeoncinema.com/theater/'
     ]
 
-    custom_settings = {
-        'CONCURRENT_REQUESTS': 1,
-    }
+    # showing flows lease sessions from session pool of their cinema, as a
+    # session is started on cinema's schedule page and agreement of
+    # another cinema may be rejected in it. each session has its own
+    # cookiejar and requests in one cookiejar should be sent one by one
+    serialize_cookiejar = True
+
+    def __init__(self, *args, **kwargs):
+        super(AeonSpider, self).__init__(*args, **kwargs)
+        # cinema name: SessionPool
+        self.session_pools = {}
+
+    def get_session_pool(self, request):
+        """
+        session pool of cinema of showing flow request
+        """
+        cinema_name = request.meta["data_proto"]['showing']['cinema_name']
+        if cinema_name not in self.session_pools:
+            self.session_pools[cinema_name] = SessionPool(
+                '{0}_{1}'.format(self.name, len(self.session_pools)),
+                self.settings.getint('SESSION_POOL_SIZE'))
+        return self.session_pools[cinema_name]
+
+    def is_session_expired(self, request, response):
+        """
+        pages of showing flow lose their content when session expires
+        """
+        markers = {
+            self.parse_agreement: 'pc.1.selectPerformance',
+            self.parse_normal_showing: 'pc.2.pinpoint.jsondata',
+        }
+        marker = markers.get(request.callback)
+        return (marker is not None and hasattr(response, 'text') and
+                marker not in response.text)
 
     def parse(self, response):
         """
@@ -46,22 +76,42 @@ class AeonSpider(ShowingSpider):
             request = scrapy.Request(curr_cinema_url,
                                      callback=self.parse_cinema)
             request.meta["data_proto"] = data_proto.load_item()
-            yield request
+            # skip cinema page if its schedule url is cached
+            schedule_url = self.get_cached_directory(cinema_name)
+            if schedule_url is None:
+                yield request
+                continue
+            for show_day in self.date_list:
+                schedule_request = self.generate_schedule_request(
+                    schedule_url, show_day, request.meta["data_proto"])
+                yield self.generate_cached_request(
+                    schedule_request, cinema_name, request)
 
     def parse_cinema(self, response):
         """
         get schedule page from cinema site
         """
-        # get schedule url and replace date string
         schedule_url = response.xpath(
             '//a[contains(@href,"dt=")]/@href').extract_first()
+        data_proto = response.meta['data_proto']
+        self.set_cached_directory(data_proto['cinema_name'], schedule_url)
+        for show_day in self.get_bootstrap_date_list(response):
+            yield self.generate_schedule_request(
+                schedule_url, show_day, data_proto,
+                dont_filter=response.meta.get(
+                    'directory_cache_fallback', False))
+
+    def generate_schedule_request(self, schedule_url, show_day, data_proto,
+                                  dont_filter=False):
+        # replace date string of schedule url
         schedule_url = re.sub(
-            r'&dt=\d+&', '&dt=' + self.date + '&', schedule_url)
-        request = scrapy.Request(schedule_url,
+            r'&dt=\d+&', '&dt=' + show_day + '&', schedule_url)
+        request = scrapy.Request(schedule_url, dont_filter=dont_filter,
                                  callback=self.parse_cinema_schedule)
-        request.meta["data_proto"] = response.meta['data_proto']
+        request.meta["data_proto"] = data_proto
         request.meta["schedule_url"] = schedule_url
-        yield request
+        request.meta["show_day"] = show_day
+        return request
 
     def parse_cinema_schedule(self, response):
         data_proto = ShowingLoader(response=response)
@@ -69,6 +119,10 @@ class AeonSpider(ShowingSpider):
         result_list = []
         movie_section_list = response.xpath(
             '//div[contains(@class,"movielist")]')
+        if not movie_section_list and self.is_cached_request(response):
+            # cached schedule url may be stale
+            yield self.fallback_cached_request(response.request)
+            return
         for curr_movie in movie_section_list:
             self.parse_movie(response, curr_movie, data_proto, result_list)
         for result in result_list:
@@ -106,16 +160,17 @@ class AeonSpider(ShowingSpider):
         time_section = curr_showing.xpath('./div[@class="time"]')
         if not time_section:
             return
+        show_day = response.meta["show_day"]
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         start_time = time_section.xpath('./span/span/text()').extract_first()
         start_hour, start_minute = parse_time(start_time)
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         end_time = time_section.xpath('./span/text()').extract_first()
         end_hour, end_minute = parse_time(end_time)
         showing_data_proto.add_value('end_time', self.get_time_from_text(
-            end_hour, end_minute))
+            show_day, end_hour, end_minute))
         screen_name = curr_showing.xpath('./div[2]/a/text()').extract_first()
         showing_data_proto.add_screen_name(screen_name)
         # when site ordering is stopped stop crawling
@@ -152,21 +207,19 @@ class AeonSpider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
-            # normal, generate request to showing page
+            # normal, generate request to showing page and send it in a
+            # leased session
             showing_request = self.generate_agreement_request(
                 response=response, curr_showing=curr_showing)
-            # go to shchedule page again to generate independent cookie
-            # for each showing
-            schedule_url = response.meta['schedule_url']
-            request = scrapy.Request(
-                schedule_url, dont_filter=True, callback=self.parse_new_cookie)
-            request.meta["data_proto"] = booking_data_proto.load_item()
-            request.meta["showing_request"] = showing_request
-            (performance_id, _, _) = self.extract_showing_parameters(
-                curr_showing)
-            request.meta["cookiejar"] = performance_id
-            result_list.append(request)
+            showing_request.meta["data_proto"] = \
+                booking_data_proto.load_item()
+            showing_request.meta["schedule_url"] = \
+                response.meta['schedule_url']
+            result_list.append(self.start_showing_flow(showing_request))
 
     def extract_showing_parameters(self, curr_showing):
         """
@@ -205,7 +258,8 @@ class AeonSpider(ShowingSpider):
                 'isSpecial': is_special,
                 'isReserved': is_reserved,
                 'displayID': display_id
-            }, callback=self.parse_agreement)
+            }, callback=self.parse_agreement,
+            errback=self.parse_session_error)
         # replace with real action generated by javascript
         theater_id = site_id
         page_id = "pc0005" if is_special == "1" else "pc0006"
@@ -216,16 +270,107 @@ class AeonSpider(ShowingSpider):
         request = request.replace(url=url)
         return request
 
+    def start_showing_flow(self, showing_request):
+        """
+        lease a session for showing flow, return its first request or None
+        if flow waits for a session
+        """
+        (cookiejar, is_new) = self.get_session_pool(
+            showing_request).lease(showing_request)
+        if cookiejar is None:
+            return None
+        return self.generate_session_request(
+            showing_request, cookiejar, is_new)
+
+    def generate_session_request(self, showing_request, cookiejar, is_new):
+        """
+        send showing request in session of cookiejar, new session is
+        started on schedule page first
+        """
+        if is_new:
+            self.crawler.stats.inc_value('session_pool/started', spider=self)
+            request = scrapy.Request(
+                showing_request.meta['schedule_url'], dont_filter=True,
+                callback=self.parse_new_cookie,
+                errback=self.parse_session_error)
+            # cookiejar may be of retired session
+            request.meta["clear_cookiejar"] = True
+        else:
+            self.crawler.stats.inc_value('session_pool/reused', spider=self)
+            request = showing_request.replace()
+        request.meta["showing_request"] = showing_request
+        request.meta["data_proto"] = showing_request.meta["data_proto"]
+        request.meta["cookiejar"] = cookiejar
+        return request
+
+    def continue_showing_flow(self, next_flow):
+        if next_flow is None:
+            return []
+        return [self.generate_session_request(*next_flow)]
+
+    def retire_session(self, response):
+        """
+        session expired, start next flow in its cookiejar and try showing
+        once more in another session
+        """
+        self.crawler.stats.inc_value('session_pool/retired', spider=self)
+        result_list = self.continue_showing_flow(
+            self.get_session_pool(response).retire(
+                response.meta["cookiejar"]))
+        showing_request = response.meta["showing_request"]
+        if not showing_request.meta.get('session_retried'):
+            showing_request = showing_request.replace()
+            showing_request.meta['session_retried'] = True
+            result_list.append(self.start_showing_flow(showing_request))
+        return result_list
+
+    def fail_session(self, request):
+        """
+        session state is unknown after showing flow failed, retire it and
+        start next flow in its cookiejar
+        """
+        self.logger.warning('showing flow failed: %s', request.url)
+        self.crawler.stats.inc_value('session_pool/retired', spider=self)
+        return self.continue_showing_flow(
+            self.get_session_pool(request).retire(
+                request.meta["cookiejar"]))
+
+    def parse_session_error(self, failure):
+        for result in self.fail_session(failure.request):
+            yield result
+
+    def run_session_step(self, response, parse_step):
+        """
+        run step of showing flow holding a session, an error in the step
+        retires the session so that flows waiting for it go on
+        """
+        try:
+            return list(parse_step(response))
+        except Exception:
+            self.logger.exception('failed to parse %s', response.url)
+            return self.fail_session(response.request)
+
     def parse_new_cookie(self, response):
+        return self.run_session_step(response, self.follow_new_cookie)
+
+    def follow_new_cookie(self, response):
         """
         generate cookie for showing page to use
         """
-        request = response.meta['showing_request']
-        request.meta["data_proto"] = response.meta['data_proto']
+        request = response.meta['showing_request'].replace()
+        request.meta["showing_request"] = response.meta['showing_request']
         request.meta["cookiejar"] = response.meta["cookiejar"]
         yield request
 
     def parse_agreement(self, response):
+        return self.run_session_step(response, self.follow_agreement)
+
+    def follow_agreement(self, response):
+        if self.is_session_expired(response.request, response):
+            for result in self.retire_session(response):
+                if result:
+                    yield result
+            return
         # extract form action url
         script_text = response.xpath(
             '//script[contains(.,"pc.1.selectPerformance")]/text()'
@@ -236,8 +381,10 @@ class AeonSpider(ShowingSpider):
             '//input[@name="displayID"]/@value').extract_first()
         url = self.generate_ticket_page_url(self, action, display_id)
         request = scrapy.Request(url, method='POST', dont_filter=True,
-                                 callback=self.parse_normal_showing)
+                                 callback=self.parse_normal_showing,
+                                 errback=self.parse_session_error)
         request.meta["data_proto"] = response.meta["data_proto"]
+        request.meta["showing_request"] = response.meta["showing_request"]
         request.meta["cookiejar"] = response.meta["cookiejar"]
         yield request
 
@@ -248,15 +395,25 @@ class AeonSpider(ShowingSpider):
                    action=action, display_id=display_id)
 
     def parse_normal_showing(self, response):
+        return self.run_session_step(response, self.follow_normal_showing)
+
+    def follow_normal_showing(self, response):
         """
         go to json data url
         """
+        if self.is_session_expired(response.request, response):
+            for result in self.retire_session(response):
+                if result:
+                    yield result
+            return
         url = response.xpath(
             '//script[contains(@src,"pc.2.pinpoint.jsondata")]/@src'
         ).extract_first()
         url = response.urljoin(url)
-        request = scrapy.Request(url, callback=self.parse_showing_json)
+        request = scrapy.Request(url, callback=self.parse_showing_json,
+                                 errback=self.parse_session_error)
         request.meta["data_proto"] = response.meta["data_proto"]
+        request.meta["showing_request"] = response.meta["showing_request"]
         request.meta["cookiejar"] = response.meta["cookiejar"]
         yield request
 
@@ -264,6 +421,12 @@ class AeonSpider(ShowingSpider):
         """
         extract showing info from json data
         """
+        # session is not used any more, pass it to next waiting flow before
+        # parsing, so parse errors do not hold it
+        for result in self.continue_showing_flow(
+                self.get_session_pool(response).release(
+                    response.meta["cookiejar"])):
+            yield result
         # TODO D-Box seat need check if handled right
         script_text = copy.deepcopy(response.text)
         script_text = re.sub(r'[\t\r\n]', '', script_text, re.DOTALL)
@@ -282,3 +445,14 @@ class AeonSpider(ShowingSpider):
         result.add_value('book_seat_count', booked_seat_count)
         result.add_time_data()
         yield result.load_item()
+
+    def closed(self, reason):
+        # flows still waiting never got a session, their showings are lost
+        waiting_count = sum(
+            len(x.waiting) for x in self.session_pools.values())
+        if waiting_count:
+            self.logger.warning('%d showing flows still wait for session',
+                                waiting_count)
+            self.crawler.stats.set_value('session_pool/waiting_at_close',
+                                         waiting_count, spider=self)
+        super(AeonSpider, self).closed(reason)
@@ -3,7 +3,7 @@ import json
 import scrapy
 from scrapyproject.showingspiders.showing_spider import ShowingSpider
 from scrapyproject.items import (ShowingLoader, init_show_booking_loader)
-from scrapyproject.utils import CinemaSunshineUtil
+from scrapyproject.utils import CinemaSunshineUtil, FormShortcut
 
 
 class CinemaSunshineSpider(ShowingSpider):
@@ -15,6 +15,11 @@ class CinemaSunshineSpider(ShowingSpider):
         'http://www.cinemasunshine.co.jp/theater/'
     ]
 
+    def __init__(self, *args, **kwargs):
+        super(CinemaSunshineSpider, self).__init__(*args, **kwargs)
+        # seat page form of agreed session of each cinema
+        self.form_shortcut = FormShortcut()
+
     def parse(self, response):
         """
         crawl theater list data first
@@ -34,11 +39,13 @@ class CinemaSunshineSpider(ShowingSpider):
                 response.urljoin(curr_cinema_url), cinema_name)
             data_proto.add_value('source', self.name)
             cinema_name_en = curr_cinema_url.split('/')[-1]
-            json_url = self.generate_cinema_schedule_url(
-                cinema_name_en, self.date)
-            request = scrapy.Request(json_url, callback=self.parse_cinema)
-            request.meta["data_proto"] = data_proto.load_item()
-            yield request
+            for show_day in self.date_list:
+                json_url = self.generate_cinema_schedule_url(
+                    cinema_name_en, show_day)
+                request = scrapy.Request(json_url, callback=self.parse_cinema)
+                request.meta["data_proto"] = data_proto.load_item()
+                request.meta["show_day"] = show_day
+                yield request
 
     def generate_cinema_schedule_url(self, cinema_name, date):
         """
@@ -109,14 +116,15 @@ class CinemaSunshineSpider(ShowingSpider):
     def parse_showing(self, response, curr_showing, data_proto, result_list):
         def parse_time(time_str):
             return (int(time_str[:2]), int(time_str[2:]))
+        show_day = response.meta["show_day"]
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         start_hour, start_minute = parse_time(curr_showing['start_time'])
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         end_hour, end_minute = parse_time(curr_showing['end_time'])
         showing_data_proto.add_value('end_time', self.get_time_from_text(
-            end_hour, end_minute))
+            show_day, end_hour, end_minute))
         showing_data_proto.add_value('seat_type', 'NormalSeat')
         # TODO get seat type right now
 
@@ -142,26 +150,129 @@ class CinemaSunshineSpider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
             # normal, need to crawl book number on order page
-            url = curr_showing['url']
-            request = scrapy.Request(url, callback=self.parse_pre_ordering)
-            request.meta["data_proto"] = booking_data_proto.load_item()
-            request.meta["dont_merge_cookies"] = True
-            result_list.append(request)
+            showing_flow = (
+                showing_data_proto.get_output_value('cinema_name'),
+                curr_showing['url'], booking_data_proto.load_item(),
+                curr_showing['start_time'])
+            result_list.append(self.start_showing_flow(showing_flow))
+
+    def start_showing_flow(self, showing_flow):
+        """
+        showing_flow is (cinema_name, url, data_proto, start time text) of
+        a showing, return first request of it or None if it waits for seat
+        page form of cinema being recorded
+        """
+        state = self.form_shortcut.start(showing_flow[0], showing_flow)
+        if state == 'wait':
+            return None
+        elif state == 'shortcut':
+            return self.generate_shortcut_request(showing_flow)
+        # a filtered request would never fail the flow and release flows
+        # waiting for its form, so no step of the flow is filtered
+        url = showing_flow[1]
+        request = scrapy.Request(url, dont_filter=True,
+                                 callback=self.parse_pre_ordering,
+                                 errback=self.parse_flow_error)
+        request.meta["data_proto"] = showing_flow[2]
+        request.meta["showing_flow"] = showing_flow
+        request.meta["dont_merge_cookies"] = True
+        return request
+
+    def generate_shortcut_request(self, showing_flow):
+        """
+        post seat page form of cinema's agreed session directly
+        """
+        (cinema_name, url, data_proto, _) = showing_flow
+        (action, encoding, formdata) = self.form_shortcut.generate(
+            cinema_name, url)
+        request = scrapy.FormRequest(
+            action, formdata=formdata, encoding=encoding, dont_filter=True,
+            callback=self.parse_normal_showing,
+            errback=self.parse_flow_error)
+        request.meta["data_proto"] = data_proto
+        request.meta["showing_flow"] = showing_flow
+        request.meta["form_shortcut"] = True
+        request.meta["dont_merge_cookies"] = True
+        return request
+
+    def fail_showing_flow(self, request):
+        """
+        showing flow of request failed, if it went through whole flow, its
+        seat page form is not recorded and flows waiting for the form are
+        started
+        """
+        if request.meta.get("form_shortcut"):
+            return []
+        showing_flow = request.meta["showing_flow"]
+        result_list = [self.start_showing_flow(x) for x in
+                       self.form_shortcut.fail(showing_flow[0])]
+        return [x for x in result_list if x]
+
+    def reject_shortcut(self, showing_flow):
+        """
+        seat page of shortcut is not of the showing, drop recorded form and
+        start showing flow again
+        """
+        self.crawler.stats.inc_value('form_shortcut/rejected', spider=self)
+        self.form_shortcut.reject(showing_flow[0])
+        request = self.start_showing_flow(showing_flow)
+        return [request] if request else []
+
+    def run_flow_step(self, response, parse_step):
+        """
+        run step of showing flow, an error in the step fails the flow so
+        that flows waiting for its seat page form go on
+        """
+        try:
+            return list(parse_step(response))
+        except Exception:
+            self.logger.exception('failed to parse %s', response.url)
+            return self.fail_showing_flow(response.request)
+
+    def parse_flow_error(self, failure):
+        request = failure.request
+        self.logger.warning('showing flow failed: %s', request.url)
+        for result in self.fail_showing_flow(request):
+            yield result
+
+    def is_shortcut_accepted(self, response):
+        """
+        seat page of shortcut is accepted if it has seats of the showing,
+        start time is shown like "9:30" or "25:10" as in schedule
+        """
+        start_time = response.meta["showing_flow"][3]
+        hours = start_time[:2]
+        minutes = start_time[2:]
+        time_texts = ['{0}:{1}'.format(hours, minutes),
+                      '{0}:{1}'.format(int(hours), minutes)]
+        return (bool(response.xpath('//img[contains(@src,"seat_")]')) and
+                any(x in response.text for x in time_texts))
 
     def parse_pre_ordering(self, response):
+        return self.run_flow_step(response, self.follow_pre_ordering)
+
+    def follow_pre_ordering(self, response):
         """
         redirect with form data
         """
         # TODO form not found bug
         request = scrapy.FormRequest.from_response(
-            response, formxpath='//form', callback=self.parse_agreement)
+            response, formxpath='//form', dont_filter=True,
+            callback=self.parse_agreement, errback=self.parse_flow_error)
         request.meta["data_proto"] = response.meta["data_proto"]
+        request.meta["showing_flow"] = response.meta["showing_flow"]
         request.meta["dont_merge_cookies"] = True
         yield request
 
     def parse_agreement(self, response):
+        return self.run_flow_step(response, self.follow_agreement)
+
+    def follow_agreement(self, response):
         """
         agreement page
         """
@@ -170,24 +281,44 @@ class CinemaSunshineSpider(ShowingSpider):
         request = scrapy.FormRequest.from_response(
             response, formxpath='//form[@name="FORM1"]',
             formdata={'agre': 'agr', 'p_agree[]': check_value},
-            callback=self.parse_select_ticket_count)
+            dont_filter=True, callback=self.parse_select_ticket_count,
+            errback=self.parse_flow_error)
         request.meta["data_proto"] = response.meta["data_proto"]
+        request.meta["showing_flow"] = response.meta["showing_flow"]
         request.meta["dont_merge_cookies"] = True
         yield request
 
     def parse_select_ticket_count(self, response):
+        return self.run_flow_step(response, self.follow_select_ticket_count)
+
+    def follow_select_ticket_count(self, response):
         """
         ticket number select page
         """
         request = scrapy.FormRequest.from_response(
             response, formxpath='//form[@name="FORM1"]',
             formdata={'goArea': 'goArea', 'ninzu[]': "1"},
-            callback=self.parse_normal_showing)
+            dont_filter=True, callback=self.parse_normal_showing,
+            errback=self.parse_flow_error)
         request.meta["data_proto"] = response.meta["data_proto"]
+        request.meta["showing_flow"] = response.meta["showing_flow"]
         request.meta["dont_merge_cookies"] = True
         yield request
+        # later showings of cinema post this form directly
+        (cinema_name, url, _, _) = response.meta["showing_flow"]
+        for showing_flow in self.form_shortcut.record(
+                cinema_name, url, request):
+            yield self.start_showing_flow(showing_flow)
 
     def parse_normal_showing(self, response):
+        if response.meta.get("form_shortcut"):
+            if not self.is_shortcut_accepted(response):
+                for result in self.reject_shortcut(
+                        response.meta["showing_flow"]):
+                    yield result
+                return
+            self.crawler.stats.inc_value('form_shortcut/accepted',
+                                         spider=self)
         # some cinemas are free seat ordered, so data may not be crawled
         booked_seat_count = len(response.xpath(
             '//img[contains(@src,"seat_102.gif")]'))
@@ -196,3 +327,14 @@ class CinemaSunshineSpider(ShowingSpider):
         result.add_value('book_seat_count', booked_seat_count)
         result.add_time_data()
         yield result.load_item()
+
+    def closed(self, reason):
+        # flows still waiting for a seat page form, their showings are lost
+        waiting_count = sum(
+            len(x) for x in self.form_shortcut.waiting.values())
+        if waiting_count:
+            self.logger.warning('%d showing flows still wait for form',
+                                waiting_count)
+            self.crawler.stats.set_value('form_shortcut/waiting_at_close',
+                                         waiting_count, spider=self)
+        super(CinemaSunshineSpider, self).closed(reason)
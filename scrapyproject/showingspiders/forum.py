@@ -35,11 +35,14 @@ class ForumSpider(ShowingSpider):
             data_proto.add_cinema_site(
                 response.urljoin(curr_cinema_url), cinema_name)
             data_proto.add_value('source', self.name)
-            schedule_url = self.generate_cinema_schedule_url(
-                curr_cinema_url, self.date)
-            request = scrapy.Request(schedule_url, callback=self.parse_cinema)
-            request.meta["data_proto"] = data_proto.load_item()
-            yield request
+            for show_day in self.date_list:
+                schedule_url = self.generate_cinema_schedule_url(
+                    curr_cinema_url, show_day)
+                request = scrapy.Request(schedule_url,
+                                         callback=self.parse_cinema)
+                request.meta["data_proto"] = data_proto.load_item()
+                request.meta["show_day"] = show_day
+                yield request
 
     def generate_cinema_schedule_url(self, curr_cinema_url, date):
         """
@@ -82,18 +85,19 @@ class ForumSpider(ShowingSpider):
             time = time_str.split(":")
             return (int(time[0]), int(time[1]))
 
+        show_day = response.meta["show_day"]
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         start_time = curr_showing.xpath(
             './span[@class="start-time digit"]/text()').extract_first()
         start_hour, start_minute = parse_time(start_time)
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         end_time = curr_showing.xpath(
             './span[@class="end-time digit"]/text()').extract_first()
         end_hour, end_minute = parse_time(end_time)
         showing_data_proto.add_value('end_time', self.get_time_from_text(
-            end_hour, end_minute))
+            show_day, end_hour, end_minute))
         # TODO cinema name extract failed
         # TODO extract name may be different from real name
         cinema_name = curr_showing.xpath(
@@ -139,6 +143,9 @@ class ForumSpider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
             # normal, need to crawl book number on order page
             url = curr_showing.xpath(
@@ -15,9 +15,8 @@ class KinezoSpider(ShowingSpider):
         'http://kinezo.jp/pc/'
     ]
     # disallow concurrent requests to avoid cookie expiring
-    custom_settings = {
-        'CONCURRENT_REQUESTS': 1
-    }
+    # site session is kept in default cookiejar, send requests one by one
+    serialize_cookiejar = True
 
     def parse(self, response):
         """
@@ -43,7 +42,16 @@ class KinezoSpider(ShowingSpider):
             request.meta["data_proto"] = data_proto.load_item()
             request.meta["cinema_name_en"] = cinema_name_en
             request.meta["dont_merge_cookies"] = True
-            yield request
+            # skip main page if schedule name of cinema is cached
+            cached_name_en = self.get_cached_directory(cinema_name)
+            if cached_name_en is None:
+                yield request
+                continue
+            for show_day in self.date_list:
+                schedule_request = self.generate_schedule_request(
+                    cached_name_en, show_day, request.meta["data_proto"])
+                yield self.generate_cached_request(
+                    schedule_request, cinema_name, request)
 
     def parse_main_page(self, response):
         """
@@ -52,11 +60,23 @@ class KinezoSpider(ShowingSpider):
         generate cookie here
         """
         cinema_name_en = response.meta["cinema_name_en"]
+        data_proto = response.meta["data_proto"]
+        self.set_cached_directory(data_proto['cinema_name'], cinema_name_en)
+        for show_day in self.get_bootstrap_date_list(response):
+            yield self.generate_schedule_request(
+                cinema_name_en, show_day, data_proto,
+                dont_filter=response.meta.get(
+                    'directory_cache_fallback', False))
+
+    def generate_schedule_request(self, cinema_name_en, show_day, data_proto,
+                                  dont_filter=False):
         schedule_url = self.generate_cinema_schedule_url(
-            cinema_name_en, self.date)
-        request = scrapy.Request(schedule_url, callback=self.parse_cinema)
-        request.meta["data_proto"] = response.meta["data_proto"]
-        yield request
+            cinema_name_en, show_day)
+        request = scrapy.Request(schedule_url, dont_filter=dont_filter,
+                                 callback=self.parse_cinema)
+        request.meta["data_proto"] = data_proto
+        request.meta["show_day"] = show_day
+        return request
 
     def generate_cinema_schedule_url(self, cinema_name_en, show_day):
         """
@@ -77,6 +97,10 @@ class KinezoSpider(ShowingSpider):
         result_list = []
         movie_title_list = response.xpath('//div[@class="cinemaTitle elp"]')
         movie_section_list = response.xpath('//div[@class="theaterListWrap"]')
+        if not movie_section_list and self.is_cached_request(response):
+            # cached schedule name may be stale
+            yield self.fallback_cached_request(response.request)
+            return
         for curr_movie in zip(movie_title_list, movie_section_list):
             self.parse_movie(response, curr_movie, data_proto, result_list)
         for result in result_list:
@@ -113,13 +137,14 @@ class KinezoSpider(ShowingSpider):
                                screen_data_proto, result_list)
 
     def parse_showing(self, response, curr_showing, data_proto, result_list):
+        show_day = response.meta["show_day"]
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         start_time = curr_showing.xpath(
             './div/text()').extract_first()[:-1]
         start_hour, start_minute = self.parse_time(start_time)
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         # end time not displayed in schedule page
 
         showing_data_proto.add_value('seat_type', 'NormalSeat')
@@ -146,15 +171,20 @@ class KinezoSpider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
             # normal, need to crawl book number on order page
             url = curr_showing.xpath('./@href').extract_first()
             url = response.urljoin(url)
             request = scrapy.Request(url, callback=self.parse_normal_showing)
             request.meta["data_proto"] = booking_data_proto.load_item()
+            request.meta["show_day"] = show_day
             result_list.append(request)
 
     def parse_normal_showing(self, response):
+        show_day = response.meta["show_day"]
         result = init_show_booking_loader(
             response=response, item=response.meta["data_proto"])
         time_text = response.xpath(
@@ -163,11 +193,11 @@ class KinezoSpider(ShowingSpider):
         start_time = time_list[0].strip()
         start_hour, start_minute = self.parse_time(start_time)
         result.get_output_value('showing')['start_time'] = \
-            self.get_time_from_text(start_hour, start_minute)
+            self.get_time_from_text(show_day, start_hour, start_minute)
         end_time = time_list[1].strip()
         end_hour, end_minute = self.parse_time(end_time)
         result.get_output_value('showing')['end_time'] = \
-            self.get_time_from_text(end_hour, end_minute)
+            self.get_time_from_text(show_day, end_hour, end_minute)
 
         booked_seat_count = len(response.xpath(
             '//li[@class="seatSell seatOff"]'))
@@ -48,7 +48,17 @@ class MovieSpider(ShowingSpider):
             request = scrapy.Request(
                 curr_cinema_url, callback=self.parse_cinema)
             request.meta["data_proto"] = data_proto.load_item()
-            yield request
+            # skip cinema page if its code is cached
+            directory = self.get_cached_directory(cinema_name)
+            if directory is None:
+                yield request
+                continue
+            for show_day in self.date_list:
+                schedule_request = self.generate_schedule_request(
+                    directory['site_url'], directory['thnumber'], show_day,
+                    request.meta["data_proto"])
+                yield self.generate_cached_request(
+                    schedule_request, cinema_name, request)
 
     def parse_cinema(self, response):
         """
@@ -57,12 +67,25 @@ class MovieSpider(ShowingSpider):
         script_text = response.xpath(
             '//script[contains(.,"thnumber")]/text()').extract_first()
         thnumber = re.findall(r'\d+', script_text)[0]
+        data_proto = response.meta["data_proto"]
+        self.set_cached_directory(data_proto['cinema_name'], {
+            'site_url': response.url, 'thnumber': thnumber})
+        for show_day in self.get_bootstrap_date_list(response):
+            yield self.generate_schedule_request(
+                response.url, thnumber, show_day, data_proto,
+                dont_filter=response.meta.get(
+                    'directory_cache_fallback', False))
+
+    def generate_schedule_request(self, site_url, thnumber, show_day,
+                                  data_proto, dont_filter=False):
         schedule_url = self.generate_cinema_schedule_url(
-            response.url, thnumber, self.date)
+            site_url, thnumber, show_day)
         request = scrapy.Request(
-            schedule_url, encoding='utf-8', callback=self.parse_shechedule)
-        request.meta["data_proto"] = response.meta["data_proto"]
-        yield request
+            schedule_url, encoding='utf-8', dont_filter=dont_filter,
+            callback=self.parse_shechedule)
+        request.meta["data_proto"] = data_proto
+        request.meta["show_day"] = show_day
+        return request
 
     def generate_cinema_schedule_url(self, site_url, thnumber, show_day):
         """
@@ -78,6 +101,10 @@ class MovieSpider(ShowingSpider):
         data_proto.add_value(None, response.meta["data_proto"])
         result_list = []
         movie_section_list = response.xpath('//div[@class="scheduleBox"]')
+        if not movie_section_list and self.is_cached_request(response):
+            # cached cinema code may be stale
+            yield self.fallback_cached_request(response.request)
+            return
         for curr_movie in movie_section_list:
             self.parse_movie(response, curr_movie, data_proto, result_list)
         for result in result_list:
@@ -107,6 +134,7 @@ class MovieSpider(ShowingSpider):
             time = time_str.split(":")
             return (int(time[0]), int(time[1]))
 
+        show_day = response.meta["show_day"]
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         screen_name = curr_showing.xpath('./p/text()').extract_first()
@@ -115,12 +143,12 @@ class MovieSpider(ShowingSpider):
             './/span[@class="strong fontXL"]/text()').extract_first()
         start_hour, start_minute = parse_time(start_time)
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         end_time = curr_showing.xpath(
             './/span[@class="strong fontXL"]/../text()').extract_first()[1:]
         end_hour, end_minute = parse_time(end_time)
         showing_data_proto.add_value('end_time', self.get_time_from_text(
-            end_hour, end_minute))
+            show_day, end_hour, end_minute))
         showing_data_proto.add_value('seat_type', 'NormalSeat')
 
         # query screen number from database
@@ -145,6 +173,9 @@ class MovieSpider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
             # normal, need to crawl book number on order page
             showing_script = curr_showing.xpath('./@onclick').extract_first()
@@ -4,7 +4,7 @@ Base class for spiders crawling movie showings
 import unicodedata
 import arrow
 import scrapy
-from scrapyproject.utils import ShowingDatabaseMixin
+from scrapyproject.utils import ShowingDatabaseMixin, CinemaDirectoryCache
 
 
 default_cinema = {
@@ -21,6 +21,13 @@ default_cinema = {
 
 
 class ShowingSpider(scrapy.Spider, ShowingDatabaseMixin):
+    # "exact" crawls seat pages for book seat count, "estimate" estimates
+    # it from book status
+    booking_mode = 'exact'
+    # bump when cached schedule ids of the chain can not be used any more
+    directory_cache_version = 1
+    _directory_cache = None
+
     def __init__(self, *args, **kwargs):
         """
         Prepare common settings for showing spider.
@@ -33,6 +40,9 @@ class ShowingSpider(scrapy.Spider, ShowingDatabaseMixin):
         # if cinema list is empty, add default cinema for spider
         if not self.cinema_list:
             self.cinema_list.append(default_cinema[self.name])
+        # days to crawl, in order
+        if not getattr(self, 'date_list', None):
+            self.date_list = [self.date]
         # normalize cinema and movie name
         for idx, item in enumerate(self.movie_list):
             self.movie_list[idx] = unicodedata.normalize('NFKC', item)
@@ -67,15 +77,106 @@ class ShowingSpider(scrapy.Spider, ShowingDatabaseMixin):
                     return True
         return False
 
-    def get_time_from_text(self, hours, minutes):
+    def get_time_from_text(self, show_day, hours, minutes):
         """
         generate arrow object from given day and time text
 
         as time like 24:40 can not be directly parsed, we need shift time
         properly
 
-        :param show_day: arrow object represent of 00:00 at show day.
+        :param show_day: show day string like 20170226, schedule page of
+        the showing is of this day.
         """
-        time = arrow.get(self.date, 'YYYYMMDD').replace(tzinfo='UTC+9')
+        time = arrow.get(show_day, 'YYYYMMDD').replace(tzinfo='UTC+9')
         time = time.shift(hours=hours, minutes=minutes)
         return time
+
+    def get_crawl_time_range(self):
+        """
+        time range that all crawled showings start in
+
+        showings after midnight like 26:00 are shown on crawl date's page,
+        so range covers day after last crawl date too.
+        """
+        start_time = arrow.get(
+            self.date_list[0], 'YYYYMMDD').replace(tzinfo='UTC+9')
+        end_time = arrow.get(
+            self.date_list[-1], 'YYYYMMDD').replace(tzinfo='UTC+9')
+        end_time = end_time.shift(days=+2)
+        return (start_time, end_time)
+
+    def add_estimated_booking(self, booking_data_proto, result_list):
+        """
+        add booking item with book seat count estimated from book status,
+        used in "estimate" booking mode instead of crawling seat page
+        """
+        booking_data_proto.add_estimated_book_seat_count()
+        booking_data_proto.add_time_data()
+        result_list.append(booking_data_proto.load_item())
+
+    @property
+    def directory_cache(self):
+        """
+        cinema directory cache of this chain, None if disabled
+        """
+        if not self.settings.getbool('DIRECTORY_CACHE_ENABLED'):
+            return None
+        if self._directory_cache is None:
+            self._directory_cache = CinemaDirectoryCache(
+                self.settings.get('DIRECTORY_CACHE_DIR'), self.name,
+                self.directory_cache_version,
+                self.settings.getint('DIRECTORY_CACHE_TTL'))
+        return self._directory_cache
+
+    def get_cached_directory(self, cinema_name):
+        if self.directory_cache is None:
+            return None
+        return self.directory_cache.get(cinema_name)
+
+    def set_cached_directory(self, cinema_name, value):
+        if self.directory_cache is not None:
+            self.directory_cache.set(cinema_name, value)
+
+    def generate_cached_request(self, request, cinema_name,
+                                bootstrap_request):
+        """
+        mark schedule request generated from cached directory entry,
+        bootstrap_request to cinema page is sent instead if it fails
+        """
+        request.meta['directory_cache_key'] = cinema_name
+        request.meta['bootstrap_request'] = bootstrap_request
+        self.crawler.stats.inc_value('directory_cache/hit', spider=self)
+        return request.replace(errback=self.parse_cached_request_error)
+
+    def is_cached_request(self, response):
+        return 'bootstrap_request' in response.meta
+
+    def get_bootstrap_date_list(self, response):
+        """
+        days to request schedule of from cinema page, only the failed day
+        if cinema page is crawled again because cached schedule failed
+        """
+        return response.meta.get('fallback_date_list', self.date_list)
+
+    def parse_cached_request_error(self, failure):
+        yield self.fallback_cached_request(failure.request)
+
+    def fallback_cached_request(self, request):
+        """
+        drop stale directory entry and crawl cinema page again, which
+        refreshes the entry
+        """
+        self.directory_cache.remove(request.meta['directory_cache_key'])
+        self.crawler.stats.inc_value('directory_cache/fallback', spider=self)
+        # cinema page is shared by schedule requests of all days
+        bootstrap_request = request.meta['bootstrap_request'].replace(
+            dont_filter=True)
+        bootstrap_request.meta['fallback_date_list'] = [
+            request.meta['show_day']]
+        # schedule page may be same as failed one
+        bootstrap_request.meta['directory_cache_fallback'] = True
+        return bootstrap_request
+
+    def closed(self, reason):
+        if self._directory_cache is not None:
+            self._directory_cache.save()
@@ -64,12 +64,18 @@ class TohoV2Spider(ShowingSpider):
             if not self.is_cinema_crawl(cinema_name_list):
                 continue
             site_cd = curr_cinema['VIT_GROUP_CD']
-            show_day = self.date
-            curr_cinema_url = self.generate_cinema_schedule_url(
-                site_cd, show_day)
-            request = scrapy.Request(curr_cinema_url,
-                                     callback=self.parse_cinema)
-            yield request
+            # schedule of several days is returned in one request
+            yield self.generate_cinema_schedule_request(
+                site_cd, self.date_list[0])
+
+    def generate_cinema_schedule_request(self, site_cd, show_day):
+        curr_cinema_url = self.generate_cinema_schedule_url(
+            site_cd, show_day)
+        request = scrapy.Request(curr_cinema_url,
+                                 callback=self.parse_cinema)
+        request.meta["site_cd"] = site_cd
+        request.meta["show_day"] = show_day
+        return request
 
     def get_cinema_name_list(self, curr_cinema):
         # replace full width text before compare
@@ -93,22 +99,33 @@ class TohoV2Spider(ShowingSpider):
         return url
 
     def parse_cinema(self, response):
-        # some cinemas may not open and will return empty response
+        # some cinemas may not open and will return empty response, days
+        # after requested day are still requested
         try:
             schedule_data = json.loads(response.text)
         except json.JSONDecodeError:
-            return
-        if (not schedule_data):
-            return
+            schedule_data = None
+        if not schedule_data:
+            schedule_data = []
         result_list = []
+        # term=99 returns schedule of several days from requested day,
+        # skip days not crawled and request days after them again
+        last_day = response.meta["show_day"]
         for curr_cinema in schedule_data:
             showing_url_parameter = {}
             date_str = curr_cinema['showDay']['date']
+            last_day = max(last_day, date_str)
+            if date_str not in self.date_list:
+                continue
             showing_url_parameter['show_day'] = arrow.get(
                 date_str, 'YYYYMMDD').replace(tzinfo='UTC+9')
             for sub_cinema in curr_cinema['list']:
                 self.parse_sub_cinema(
                     response, sub_cinema, showing_url_parameter, result_list)
+        next_days = [x for x in self.date_list if x > last_day]
+        if next_days:
+            result_list.append(self.generate_cinema_schedule_request(
+                response.meta["site_cd"], next_days[0]))
         for result in result_list:
             if result:
                 yield result
@@ -167,16 +184,17 @@ class TohoV2Spider(ShowingSpider):
             time = time_str.split(":")
             return (int(time[0]), int(time[1]))
         showing_url_parameter['showing_cd'] = curr_showing['code']
+        show_day = showing_url_parameter['show_day'].format('YYYYMMDD')
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         # time like 24:40 can not be directly parsed,
         # so we need to shift time properly
         start_hour, start_minute = parse_time(curr_showing['showingStart'])
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         end_hour, end_minute = parse_time(curr_showing['showingEnd'])
         showing_data_proto.add_value('end_time', self.get_time_from_text(
-            end_hour, end_minute))
+            show_day, end_hour, end_minute))
         showing_data_proto.add_value('seat_type', 'NormalSeat')
 
         # query screen number from database
@@ -200,6 +218,9 @@ class TohoV2Spider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
             # normal, need to crawl book number on order page
             url = self.generate_showing_url(**showing_url_parameter)
@@ -43,11 +43,14 @@ class UnitedSpider(ShowingSpider):
             if not self.is_cinema_crawl([cinema_name]):
                 continue
             cinema_name_en = curr_cinema_url.split('/')[-2]
-            schedule_url = self.generate_cinema_schedule_url(
-                cinema_name_en, self.date)
-            request = scrapy.Request(schedule_url, callback=self.parse_cinema)
-            request.meta["data_proto"] = data_proto.load_item()
-            yield request
+            for show_day in self.date_list:
+                schedule_url = self.generate_cinema_schedule_url(
+                    cinema_name_en, show_day)
+                request = scrapy.Request(schedule_url,
+                                         callback=self.parse_cinema)
+                request.meta["data_proto"] = data_proto.load_item()
+                request.meta["show_day"] = show_day
+                yield request
 
     def generate_cinema_schedule_url(self, cinema_name_en, show_day):
         """
@@ -102,18 +105,19 @@ class UnitedSpider(ShowingSpider):
             time = time_str.split(":")
             return (int(time[0]), int(time[1]))
 
+        show_day = response.meta["show_day"]
         showing_data_proto = ShowingLoader(response=response)
         showing_data_proto.add_value(None, data_proto.load_item())
         start_time = curr_showing.xpath(
             './div/ol/li[@class="startTime"]/text()').extract_first()
         start_hour, start_minute = parse_time(start_time)
         showing_data_proto.add_value('start_time', self.get_time_from_text(
-            start_hour, start_minute))
+            show_day, start_hour, start_minute))
         end_time = curr_showing.xpath(
             './div/ol/li[@class="endTime"]/text()').extract_first()[1:]
         end_hour, end_minute = parse_time(end_time)
         showing_data_proto.add_value('end_time', self.get_time_from_text(
-            end_hour, end_minute))
+            show_day, end_hour, end_minute))
         # handle free order seat type showings
         seat_type = curr_showing.xpath(
             './div/ul/li[@class="seatIcon"]/img/@src').extract_first()
@@ -144,6 +148,9 @@ class UnitedSpider(ShowingSpider):
             booking_data_proto.add_time_data()
             result_list.append(booking_data_proto.load_item())
             return
+        elif self.booking_mode == 'estimate':
+            self.add_estimated_booking(booking_data_proto, result_list)
+            return
         else:
             # normal, need to crawl book number on order page
             # we will visit schedule page again to generate independent cookie
@@ -3,6 +3,9 @@ Util classes
 """
 
 from scrapyproject.utils.screen_utils import ScreenUtils
+from scrapyproject.utils.directory_cache import CinemaDirectoryCache
+from scrapyproject.utils.session_pool import SessionPool
+from scrapyproject.utils.form_shortcut import FormShortcut
 from scrapyproject.utils.site_utils import *
 from scrapyproject.utils.spider_helper import *
 from scrapyproject.utils.test_utils import TestUtil
@@ -0,0 +1,62 @@
+import json
+import os
+import time
+
+
+class CinemaDirectoryCache(object):
+    """
+    schedule ids of cinemas of a chain, like movix thnumber and aeon
+    schedule url, kept in a json file between crawls so that spiders can
+    skip cinema pages.
+
+    entries older than ttl seconds are not used. whole file is unused when
+    version changes, spiders bump version when site layout changes.
+    """
+    def __init__(self, path, name, version, ttl):
+        self.file_path = os.path.join(path, name + '.json')
+        self.version = version
+        self.ttl = ttl
+        self.entries = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, encoding='utf-8') as cache_file:
+                data = json.load(cache_file)
+        except ValueError:
+            # broken file is replaced on next save
+            return
+        if data.get('version') != self.version:
+            return
+        self.entries = data.get('entries', {})
+
+    def get(self, key):
+        """
+        return cached value, or None if not cached or expired
+        """
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        self.entries[key] = {'value': value, 'time': time.time()}
+        self.changed = True
+
+    def remove(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'version': self.version, 'entries': self.entries},
+                      cache_file, ensure_ascii=False)
+        os.replace(temp_path, self.file_path)
+        self.changed = False
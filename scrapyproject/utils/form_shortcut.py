@@ -0,0 +1,93 @@
+from urllib.parse import urlparse, parse_qsl
+
+
+class FormShortcut(object):
+    """
+    last form of a multi form flow recorded per session key (like cinema),
+    so that later flows of the same key can post it directly.
+
+    a field whose value is a query parameter of flow's entry url is filled
+    from entry url of each flow, other fields are constant in the session.
+    while first flow of a key records the form, other flows of the key
+    wait for it. a rejected form is recorded again, a key is not
+    shortcut any more after max_rejected_count rejections.
+    """
+    def __init__(self, max_rejected_count=3):
+        self.max_rejected_count = max_rejected_count
+        # key: (url, encoding, [(name, value, entry url parameter name)])
+        self.templates = {}
+        self.recording = set()
+        # keys whose form has no field from entry url or is rejected too
+        # many times, never shortcut
+        self.unsupported = set()
+        self.rejected_counts = {}
+        self.waiting = {}
+
+    def start(self, key, flow):
+        """
+        return "shortcut" if flow can post recorded form, "record" if flow
+        should go through whole flow and record form, or "wait" if flow
+        waits for recording flow, it is returned by record or fail later
+        """
+        if key in self.templates:
+            return 'shortcut'
+        if key in self.unsupported:
+            return 'record'
+        if key in self.recording:
+            self.waiting.setdefault(key, []).append(flow)
+            return 'wait'
+        self.recording.add(key)
+        return 'record'
+
+    def record(self, key, entry_url, request):
+        """
+        record form request of last step, return waiting flows
+        """
+        if key in self.unsupported:
+            return self.waiting.pop(key, [])
+        entry_params = parse_qsl(urlparse(entry_url).query)
+        # first parameter name of each value
+        param_names = dict((value, name)
+                           for name, value in reversed(entry_params) if value)
+        body = request.body.decode(request.encoding)
+        fields = [(name, value, param_names.get(value))
+                  for name, value in parse_qsl(
+                      body, keep_blank_values=True,
+                      encoding=request.encoding)]
+        if any(param for _, _, param in fields):
+            self.templates[key] = (request.url, request.encoding, fields)
+        else:
+            # every flow would post the same showing
+            self.unsupported.add(key)
+        self.recording.discard(key)
+        return self.waiting.pop(key, [])
+
+    def generate(self, key, entry_url):
+        """
+        return (url, encoding, formdata) of recorded form for flow
+        """
+        (url, encoding, fields) = self.templates[key]
+        entry_params = dict(parse_qsl(urlparse(entry_url).query))
+        formdata = [(name, entry_params.get(param, value)) if param else
+                    (name, value) for name, value, param in fields]
+        return (url, encoding, formdata)
+
+    def fail(self, key):
+        """
+        recording flow failed, return waiting flows, first of them should
+        record form again
+        """
+        self.recording.discard(key)
+        return self.waiting.pop(key, [])
+
+    def reject(self, key):
+        """
+        drop recorded form when server rejected a flow posting it, later
+        flows record it again. flows posting the same form may be rejected
+        together, only first of them is counted
+        """
+        if self.templates.pop(key, None) is None:
+            return
+        self.rejected_counts[key] = self.rejected_counts.get(key, 0) + 1
+        if self.rejected_counts[key] >= self.max_rejected_count:
+            self.unsupported.add(key)
@@ -0,0 +1,52 @@
+from collections import deque
+
+
+class SessionPool(object):
+    """
+    bounded pool of site sessions, each session is kept in its own
+    cookiejar so cookiejars do not grow with count of crawled showings.
+
+    a flow (any object, usually first request of a multi request flow)
+    leases a session, sends its requests in session's cookiejar and
+    releases the session when done. flows wait in order when all sessions
+    are leased.
+    """
+    def __init__(self, name, max_count):
+        # sessions started and ready for next flow
+        self.idle = deque()
+        # cookiejars without session, not started yet or retired
+        self.free = deque('{0}_session_{1}'.format(name, x)
+                          for x in range(max_count))
+        self.waiting = deque()
+
+    def lease(self, flow):
+        """
+        return (cookiejar, is_new) for flow, session in cookiejar should be
+        started first if is_new. cookiejar is None if flow is waiting, it
+        is returned by release or retire later.
+        """
+        if self.idle:
+            return (self.idle.popleft(), False)
+        if self.free:
+            return (self.free.popleft(), True)
+        self.waiting.append(flow)
+        return (None, False)
+
+    def release(self, cookiejar):
+        """
+        return session after flow is done, return (flow, cookiejar, is_new)
+        of next waiting flow which continues on it, or None
+        """
+        if self.waiting:
+            return (self.waiting.popleft(), cookiejar, False)
+        self.idle.append(cookiejar)
+        return None
+
+    def retire(self, cookiejar):
+        """
+        drop expired session, see release
+        """
+        if self.waiting:
+            return (self.waiting.popleft(), cookiejar, True)
+        self.free.append(cookiejar)
+        return None
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import unittest
+from scrapy.exceptions import UsageError
+from scrapyproject.commands.crawl import get_date_list
+
+
+class GetDateListTest(unittest.TestCase):
+    def test_days_in_order_both_included(self):
+        self.assertEqual(get_date_list('20170227:20170302'),
+                         ['20170227', '20170228', '20170301', '20170302'])
+
+    def test_single_day(self):
+        self.assertEqual(get_date_list('20170301:20170301'), ['20170301'])
+
+    def test_start_later_than_end(self):
+        with self.assertRaises(UsageError):
+            get_date_list('20170302:20170301')
+
+    def test_invalid_range(self):
+        for date_range in ('20170301', '20170301:', '2017-03-01:20170302'):
+            with self.assertRaises(UsageError):
+                get_date_list(date_range)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import unittest
+import scrapy
+from scrapyproject.utils import FormShortcut
+
+
+entry_url = 'http://example.com/order?code=001&seq=7'
+other_entry_url = 'http://example.com/order?code=001&seq=8'
+
+
+def seat_form_request():
+    return scrapy.FormRequest(
+        'http://example.com/seat', formdata=[
+            ('seq', '7'), ('session', 'abc'), ('ninzu[]', '1')])
+
+
+class FormShortcutTest(unittest.TestCase):
+    def setUp(self):
+        self.shortcut = FormShortcut()
+
+    def test_first_flow_records_others_wait(self):
+        self.assertEqual(self.shortcut.start('cinema', 'a'), 'record')
+        self.assertEqual(self.shortcut.start('cinema', 'b'), 'wait')
+        self.assertEqual(self.shortcut.start('cinema', 'c'), 'wait')
+        self.assertEqual(
+            self.shortcut.record('cinema', entry_url, seat_form_request()),
+            ['b', 'c'])
+        self.assertEqual(self.shortcut.start('cinema', 'd'), 'shortcut')
+
+    def test_generate_fills_entry_url_parameters(self):
+        self.shortcut.start('cinema', 'a')
+        self.shortcut.record('cinema', entry_url, seat_form_request())
+        (url, encoding, formdata) = self.shortcut.generate(
+            'cinema', other_entry_url)
+        self.assertEqual(url, 'http://example.com/seat')
+        self.assertEqual(encoding, 'utf-8')
+        self.assertEqual(formdata, [
+            ('seq', '8'), ('session', 'abc'), ('ninzu[]', '1')])
+
+    def test_form_without_entry_url_field_is_unsupported(self):
+        self.shortcut.start('cinema', 'a')
+        request = scrapy.FormRequest('http://example.com/seat',
+                                     formdata={'session': 'abc'})
+        self.shortcut.record('cinema', entry_url, request)
+        self.assertEqual(self.shortcut.start('cinema', 'b'), 'record')
+        self.assertEqual(self.shortcut.start('cinema', 'c'), 'record')
+
+    def test_failed_recording_returns_waiting_flows(self):
+        self.shortcut.start('cinema', 'a')
+        self.shortcut.start('cinema', 'b')
+        self.assertEqual(self.shortcut.fail('cinema'), ['b'])
+        self.assertEqual(self.shortcut.start('cinema', 'b'), 'record')
+
+    def test_rejected_form_is_recorded_again(self):
+        self.shortcut.start('cinema', 'a')
+        self.shortcut.record('cinema', entry_url, seat_form_request())
+        self.shortcut.reject('cinema')
+        # flows rejected together count once
+        self.shortcut.reject('cinema')
+        self.assertEqual(self.shortcut.rejected_counts['cinema'], 1)
+        self.assertEqual(self.shortcut.start('cinema', 'b'), 'record')
+        self.assertEqual(self.shortcut.start('cinema', 'c'), 'wait')
+
+    def test_unsupported_after_max_rejected_count(self):
+        for _ in range(self.shortcut.max_rejected_count):
+            self.shortcut.start('cinema', 'a')
+            self.shortcut.record('cinema', entry_url, seat_form_request())
+            self.shortcut.reject('cinema')
+        self.assertEqual(self.shortcut.start('cinema', 'b'), 'record')
+        self.assertEqual(self.shortcut.start('cinema', 'c'), 'record')
+        self.assertEqual(
+            self.shortcut.record('cinema', entry_url, seat_form_request()),
+            [])
+        self.assertEqual(self.shortcut.start('cinema', 'd'), 'record')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import unittest
+from fuzzywuzzy import process
+from scrapyproject.models import MovieTitleResolver
+
+
+movie_titles = [
+    '君の名は。',
+    '聲の形',
+    'この世界の片隅に',
+    'ラ・ラ・ランド',
+    'モアナと伝説の海',
+    'ドクター・ストレンジ',
+    'Fantastic Beasts and Where to Find Them',
+    'SING/シング',
+    'ONE PIECE FILM GOLD',
+    '名探偵コナン から紅の恋歌',
+    '  ',
+    'A B C D',
+]
+
+crawled_titles = [
+    '君の名は。',
+    '君の名は。 (字幕版)',
+    '映画 聲の形',
+    'この世界の片隅に【舞台挨拶付】',
+    'ラ・ラ・ランド(字幕版)',
+    'モアナと伝説の海(吹替版)',
+    'ドクター・ストレンジ 3D',
+    'Fantastic Beasts',
+    'SING',
+    'ONE PIECE',
+    '名探偵コナン',
+    'ひるね姫',
+    'LOGAN',
+    'A',
+    ' ',
+    '',
+]
+
+
+class MovieTitleResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.resolver = MovieTitleResolver()
+        self.resolver.index_titles(movie_titles)
+        self.resolver.loaded = True
+
+    def test_same_result_as_brute_force(self):
+        for title in crawled_titles:
+            one_item = process.extractOne(title, movie_titles)
+            expected = one_item[0] if one_item and one_item[1] > 60 else None
+            self.assertEqual(self.resolver.get_by_title(title), expected,
+                             title)
+
+    def test_left_out_titles_score_at_most_50(self):
+        for title in crawled_titles:
+            candidates = set(self.resolver.get_candidates(title))
+            for movie_title in movie_titles:
+                if movie_title in candidates:
+                    continue
+                one_item = process.extractOne(title, [movie_title])
+                score = one_item[1] if one_item else 0
+                self.assertLessEqual(score, 50, (title, movie_title))
+
+
+if __name__ == '__main__':
+    unittest.main()
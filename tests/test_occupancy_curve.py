@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import unittest
+import numpy
+from occupancy_curve import compute_curves, aggregate_curves
+
+
+nan = float('nan')
+
+
+def new_snapshots():
+    """
+    showing 1 has 100 seats and snapshots at 0, 60 and 120 minutes before
+    start, showing 2 has 50 seats and snapshots at 30 and 90
+    """
+    return {
+        'showing_id': numpy.array([1, 1, 1, 2, 2], dtype=numpy.float64),
+        'total_seat_count': numpy.array([100, 100, 100, 50, 50],
+                                        dtype=numpy.float64),
+        'minutes_before': numpy.array([0, 60, 120, 30, 90],
+                                      dtype=numpy.float64),
+        'book_seat_count': numpy.array([10, 5, 0, 20, 10],
+                                       dtype=numpy.float64),
+    }
+
+
+class OccupancyCurveTest(unittest.TestCase):
+    def setUp(self):
+        self.grid = numpy.array([0, 30, 60, 90, 120], dtype=numpy.float64)
+
+    def test_interpolate_each_showing_without_extrapolation(self):
+        starts, curves = compute_curves(new_snapshots(), self.grid)
+        self.assertEqual(list(starts), [0, 3])
+        numpy.testing.assert_allclose(curves, [
+            [0.1, 0.075, 0.05, 0.025, 0],
+            [nan, 0.4, 0.3, 0.2, nan],
+        ])
+
+    def test_average_ignores_missing_points(self):
+        _, curves = compute_curves(new_snapshots(), self.grid)
+        labels, showing_counts, means = aggregate_curves(
+            numpy.array(['a', 'a'], dtype=object), curves)
+        self.assertEqual(list(labels), ['a'])
+        self.assertEqual(list(showing_counts), [2])
+        numpy.testing.assert_allclose(
+            means, [[0.1, 0.2375, 0.175, 0.1125, 0]])
+
+    def test_average_per_label(self):
+        _, curves = compute_curves(new_snapshots(), self.grid)
+        labels, showing_counts, means = aggregate_curves(
+            numpy.array(['b', 'a'], dtype=object), curves)
+        self.assertEqual(list(labels), ['a', 'b'])
+        self.assertEqual(list(showing_counts), [1, 1])
+        numpy.testing.assert_allclose(means, [
+            [nan, 0.4, 0.3, 0.2, nan],
+            [0.1, 0.075, 0.05, 0.025, 0],
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+from unittest import mock
+import query_service
+
+
+class QueryOccupancyTest(unittest.TestCase):
+    def test_rows_per_show_date(self):
+        rows = [(datetime.date(2017, 3, 1), 30, 100, 2, 1),
+                (datetime.date(2017, 3, 2), None, None, None, None)]
+        with mock.patch.object(query_service.models.BookingRollup,
+                               'get_date_totals',
+                               return_value=rows) as get_date_totals:
+            results = query_service.query_occupancy(
+                {'title': 'title', 'cinema': 'cinema'}, True)
+        get_date_totals.assert_called_once_with('title', 'cinema', True)
+        self.assertEqual(results, [
+            {'key': '2017-03-01', 'book_seat_count': 30,
+             'total_seat_count': 100, 'percent': 0.3, 'count': 2,
+             'estimated_count': 1},
+            {'key': '2017-03-02', 'book_seat_count': 0,
+             'total_seat_count': 0, 'percent': 0.0, 'count': 0,
+             'estimated_count': 0},
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
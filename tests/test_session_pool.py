@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import unittest
+from scrapyproject.utils import SessionPool
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = SessionPool('test', 2)
+
+    def test_new_sessions_until_max_count(self):
+        self.assertEqual(self.pool.lease('a'), ('test_session_0', True))
+        self.assertEqual(self.pool.lease('b'), ('test_session_1', True))
+        self.assertEqual(self.pool.lease('c'), (None, False))
+        self.assertEqual(list(self.pool.waiting), ['c'])
+
+    def test_released_session_is_reused(self):
+        (cookiejar, _) = self.pool.lease('a')
+        self.assertIsNone(self.pool.release(cookiejar))
+        self.assertEqual(self.pool.lease('b'), (cookiejar, False))
+
+    def test_release_continues_waiting_flows_in_order(self):
+        (cookiejar, _) = self.pool.lease('a')
+        self.pool.lease('b')
+        self.pool.lease('c')
+        self.pool.lease('d')
+        self.assertEqual(self.pool.release(cookiejar),
+                         ('c', cookiejar, False))
+        self.assertEqual(self.pool.release(cookiejar),
+                         ('d', cookiejar, False))
+        self.assertIsNone(self.pool.release(cookiejar))
+        self.assertEqual(list(self.pool.idle), [cookiejar])
+
+    def test_retired_session_is_started_again(self):
+        (cookiejar, _) = self.pool.lease('a')
+        self.pool.lease('b')
+        self.pool.lease('c')
+        self.assertEqual(self.pool.retire(cookiejar), ('c', cookiejar, True))
+        self.assertIsNone(self.pool.retire(cookiejar))
+        self.assertEqual(self.pool.lease('d'), (cookiejar, True))
+
+    def test_idle_session_before_new_one(self):
+        (cookiejar, _) = self.pool.lease('a')
+        self.pool.release(cookiejar)
+        self.assertEqual(self.pool.lease('b'), (cookiejar, False))
+        self.assertEqual(self.pool.lease('c'), ('test_session_1', True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import unittest
+import arrow
+from scrapyproject.models import Showing, ShowingIndex
+
+
+def new_showing(start_time, screen='screen 1'):
+    return Showing(cinema_site='http://example.com/', screen=screen,
+                   start_time=arrow.get(start_time))
+
+
+class ShowingIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = ShowingIndex()
+        # searched range is loaded so that database is not queried
+        self.index.loaded_ranges.append((arrow.get('2017-03-01T00:00:00'),
+                                         arrow.get('2017-03-02T00:00:00')))
+        self.showing = new_showing('2017-03-01T10:00:50')
+        self.index.add(self.showing)
+
+    def test_same_start_time(self):
+        self.assertIs(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T10:00:50')), self.showing)
+
+    def test_start_time_in_next_minute(self):
+        self.assertIs(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T10:01:30')), self.showing)
+        self.assertIs(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T10:00:10')), self.showing)
+
+    def test_start_time_one_minute_apart(self):
+        self.assertIsNone(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T10:01:50')))
+        self.assertIsNone(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T09:59:50')))
+
+    def test_other_screen(self):
+        self.assertIsNone(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T10:00:50', screen='screen 2')))
+
+    def test_rollback_removes_pending_showings(self):
+        self.index.commit()
+        pending_showing = new_showing('2017-03-01T12:00:00')
+        self.index.add(pending_showing)
+        self.index.rollback()
+        self.assertIsNone(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T12:00:00')))
+        self.assertIs(self.index.get_showing_if_exist(
+            new_showing('2017-03-01T10:00:50')), self.showing)
+
+
+if __name__ == '__main__':
+    unittest.main()
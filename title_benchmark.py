@@ -0,0 +1,93 @@
+"""
+Micro benchmark of crawled title resolving, compares Movie.get_by_title
+with MovieTitleResolver using showing titles in database, and checks that
+both give the same result.
+
+It also checks the assumption of MovieTitleResolver's character index:
+movie titles left out of candidates of a crawled title score at most 50.
+exit status is 1 if any check fails.
+"""
+import argparse
+import sys
+import time
+from fuzzywuzzy import process
+from scrapyproject import models
+
+
+def time_resolve(resolve, titles):
+    start_time = time.perf_counter()
+    result = [resolve(title) for title in titles]
+    return result, time.perf_counter() - start_time
+
+
+def check_candidates(resolver, titles):
+    """
+    return (title, movie title, score) of movie titles left out of
+    candidates that score over 50
+    """
+    result = []
+    for title in titles:
+        candidates = set(resolver.get_candidates(title))
+        excluded = [x for x in resolver.titles if x not in candidates]
+        one_item = process.extractOne(title, excluded)
+        if one_item and one_item[1] > 50:
+            result.append((title, one_item[0], one_item[1]))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Movie title resolver benchmark program.')
+    parser.add_argument('--count', type=int, required=False, default=1000,
+                        help='count of showing titles to resolve')
+    args = parser.parse_args()
+    query = models.Session.query(models.Showing.title).order_by(
+        models.Showing.id.desc()).limit(args.count)
+    titles = [title for title, in query.all()]
+    distinct_titles = sorted(set(titles))
+    print("{0} titles, {1} distinct, {2} movies".format(
+        len(titles), len(distinct_titles),
+        models.Session.query(models.Movie).count()))
+
+    old_result, old_time = time_resolve(models.Movie.get_by_title, titles)
+    print("Movie.get_by_title: {0:.3f}s".format(old_time))
+    resolver = models.MovieTitleResolver()
+    start_time = time.perf_counter()
+    resolver.load()
+    print("MovieTitleResolver load: {0:.3f}s".format(
+        time.perf_counter() - start_time))
+    _, cold_time = time_resolve(resolver.get_by_title, distinct_titles)
+    print("MovieTitleResolver distinct titles: {0:.3f}s".format(cold_time))
+    new_result, new_time = time_resolve(resolver.get_by_title, titles)
+    print("MovieTitleResolver all titles (memorized): {0:.3f}s".format(
+        new_time))
+
+    mismatch_count = 0
+    for title, old_title, new_title in zip(titles, old_result, new_result):
+        if old_title != new_title:
+            mismatch_count += 1
+            print("mismatch: {0} {1} {2}".format(title, old_title, new_title))
+    print("{0} mismatches".format(mismatch_count))
+    # brute force on same loaded titles, so database changes do not matter
+    brute_force_count = 0
+    for title in distinct_titles:
+        one_item = process.extractOne(title, resolver.titles)
+        brute_force_title = (one_item[0] if one_item and one_item[1] > 60
+                             else None)
+        if brute_force_title != resolver.get_by_title(title):
+            brute_force_count += 1
+            print("brute force mismatch: {0} {1} {2}".format(
+                title, brute_force_title, resolver.get_by_title(title)))
+    print("{0} brute force mismatches".format(brute_force_count))
+    violations = check_candidates(resolver, distinct_titles)
+    for title, movie_title, score in violations:
+        print("left out candidate: {0} {1} {2}".format(
+            title, movie_title, score))
+    print("{0} left out candidates score over 50".format(len(violations)))
+    models.Session.remove()
+    if mismatch_count or brute_force_count or violations:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()